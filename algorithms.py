@@ -1,187 +1,706 @@
-from math import inf
+import hashlib
+from collections import OrderedDict
+from time import perf_counter
+import numpy as np
+from bush import Bush
 from datas import Network
+from parallel import ParallelLoader
+from paths import combine_flows
+from shortest_path import dial_load, dijkstra, load_tree
 
 
 class TrafficAssignment:
-    def __init__(self, network: Network):
+    def __init__(self, network: Network, workers=1, tree_cache_mb=256):
         self.network = network
         self.n = network.n
+        self.m = network.m
         self.names = network.get_names()
-        self.adjacency = network.get_adjacency_matrix()
-        self.capacity_matrix = network.get_capacity_matrix()
-        self.time_link = network.get_time_link()
-        self.od_pairs = network.get_demand_data()
-    
-    def floyd_warshall(self, time_matrix):
-        """使用Floyd-Warshall算法计算所有节点对之间的最短路径"""
-        n = self.n
-        dist = [[inf] * n for _ in range(n)]
-        path = [[-1] * n for _ in range(n)]
-        
-        # 初始化距离矩阵和路径矩阵
-        for i in range(n):
-            for j in range(n):
-                if i == j:
-                    dist[i][j] = 0
-                elif self.adjacency[i][j]:
-                    dist[i][j] = time_matrix[i][j]
-                    path[i][j] = j
-        
-        # Floyd-Warshall算法
-        for k in range(n):
-            for i in range(n):
-                for j in range(n):
-                    if dist[i][k] + dist[k][j] < dist[i][j]:
-                        dist[i][j] = dist[i][k] + dist[k][j]
-                        path[i][j] = path[i][k]
-        
-        return dist, path
-    
-    def get_path_from_path_matrix(self, path_matrix, origin, destination):
-        """从路径矩阵中提取具体路径"""
-        if path_matrix[origin][destination] == -1:
+        # 最短路内循环使用Python列表，避免逐元素访问NumPy数组的开销
+        link_from, link_to = network.get_links()
+        first_out, _ = network.get_forward_star()
+        self.link_from, self.link_to = link_from.tolist(), link_to.tolist()
+        self.first_out = first_out.tolist()
+        # 零流量下的路段时间（自由流时间），通行能力为0的关闭路段为inf，各求解器的初始最短路径树都以此为准
+        self.time_link = network.calculate_congested_time(network.zero_flow())
+
+        # 按起点分组的需求 {起点: (终点编号数组, 需求量数组)}
+        self.origin_demand = network.get_origin_demand()
+
+        # 基于起点算法求解后的各起点bush
+        self.bushes = None
+        # 最近一次迭代求解实际执行的迭代次数
+        self.iterations = 0
+        # 各阶段累计用时（秒），供SolverMonitor按迭代统计
+        self.timings = dict.fromkeys(('shortest_path', 'loading', 'parallel_load', 'cost_update',
+                                      'line_search', 'bush_update'), 0.0)
+
+        # 最短路径树LRU缓存 {(路段费用指纹, 起点): (距离, 前驱弧, 节点确定顺序)紧凑数组}，求解、结果输出和分析共用
+        # 按内存上限（MB）淘汰，每棵树约占 16n 字节
+        self.tree_cache_mb = tree_cache_mb
+        self._tree_cache = OrderedDict()
+        self._tree_cache_bytes = 0
+        self._tree_cache_hits = self._tree_cache_misses = 0
+
+        # workers > 1 时按起点划分到多个进程并行执行全有全无加载
+        self._parallel = ParallelLoader(self, workers) if workers > 1 else None
+
+    @property
+    def od_pairs(self):
+        """按输入顺序排列的OD对列表 [(起点, 终点, 需求), ...]"""
+        return self.network.get_demand_data()
+
+    def close(self):
+        """关闭并行加载使用的进程池和共享内存"""
+        if self._parallel is not None:
+            self._parallel.close()
+            self._parallel = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def shortest_path_tree(self, link_time, origin):
+        """使用二叉堆Dijkstra算法计算单起点最短路径树，返回(距离, 前驱弧, 节点确定顺序)"""
+        return next(self._trees(link_time, [origin]))[1]
+
+    def shortest_path_trees(self, link_time, origins=None):
+        """为有需求的各起点计算最短路径树"""
+        if origins is None:
+            origins = self.origin_demand
+        return dict(self._trees(link_time, origins))
+
+    def skim_matrix(self, link_time, origins=None, destinations=None):
+        """计算起点×终点的最短路径时间矩阵"""
+        origins = list(self.origin_demand) if origins is None else list(origins)
+        destinations = list(range(self.n)) if destinations is None else list(destinations)
+        skim = np.empty((len(origins), len(destinations)))
+        for row, (_, (dist, _, _)) in enumerate(self._trees(link_time, origins)):
+            skim[row] = [dist[j] for j in destinations]
+        return skim
+
+    @staticmethod
+    def cost_fingerprint(link_time):
+        """路段费用向量的指纹，用作最短路径树缓存的键"""
+        return hashlib.blake2b(np.ascontiguousarray(link_time, dtype=float).tobytes(), digest_size=16).digest()
+
+    def _trees(self, link_time, origins):
+        """依次产生各起点的(起点, 最短路径树)，优先使用缓存，未命中时计算并放入缓存"""
+        link_time = np.asarray(link_time, dtype=float)
+        fingerprint = self.cost_fingerprint(link_time)
+        link_time_list = None
+        for origin in origins:
+            key = (fingerprint, origin)
+            entry = self._tree_cache.get(key)
+            if entry is not None:
+                self._tree_cache.move_to_end(key)
+                self._tree_cache_hits += 1
+                tree = tuple(array.tolist() for array in entry)
+            else:
+                if link_time_list is None:
+                    link_time_list = link_time.tolist()
+                start = perf_counter()
+                tree = self._dijkstra(link_time_list, origin)
+                self.timings['shortest_path'] += perf_counter() - start
+                self._tree_cache_misses += 1
+                self._cache_tree(key, tree)
+            yield origin, tree
+
+    def _cache_tree(self, key, tree):
+        """以紧凑数组形式缓存最短路径树，超出内存上限时淘汰最久未用的树
+
+        只淘汰其他费用向量下的树：同一费用向量下一轮各起点的树超出上限时保留先缓存的部分，
+        避免按起点顺序逐个挤掉本轮刚算出的树。
+        """
+        limit = self.tree_cache_mb * 2 ** 20
+        if limit <= 0:
+            return
+        dist, pred, order = tree
+        entry = (np.array(dist, dtype=float), np.array(pred, dtype=np.int32), np.array(order, dtype=np.int32))
+        size = sum(array.nbytes for array in entry)
+        while self._tree_cache_bytes + size > limit and self._tree_cache:
+            oldest = next(iter(self._tree_cache))
+            if oldest[0] == key[0]:
+                return
+            self._tree_cache_bytes -= sum(array.nbytes for array in self._tree_cache.pop(oldest))
+        if self._tree_cache_bytes + size <= limit:
+            self._tree_cache[key] = entry
+            self._tree_cache_bytes += size
+
+    def tree_cache_info(self):
+        """最短路径树缓存的命中次数、未命中次数、当前树数和占用内存（MB）"""
+        return {'hits': self._tree_cache_hits, 'misses': self._tree_cache_misses, 'size': len(self._tree_cache),
+                'memory_mb': self._tree_cache_bytes / 2 ** 20}
+
+    def clear_tree_cache(self):
+        """清空最短路径树缓存"""
+        self._tree_cache.clear()
+        self._tree_cache_bytes = 0
+
+    def _dijkstra(self, link_time, origin):
+        """Dijkstra算法主体，link_time为Python列表"""
+        return dijkstra(self.first_out, self.link_to, link_time, origin)
+
+    def get_path_from_tree(self, tree, destination):
+        """从最短路径树中提取到终点的节点路径"""
+        _, pred, _ = tree
+        if pred[destination] == -1:
             return []
-        
-        path = [origin]
-        current = origin
-        while current != destination:
-            current = path_matrix[current][destination]
-            path.append(current)
-        
+
+        path = [destination]
+        k = pred[destination]
+        while k != -1:
+            path.append(self.link_from[k])
+            k = pred[self.link_from[k]]
+        path.reverse()
         return path
-    
-    def all_or_nothing_assignment(self):
-        """全有全无分配算法"""
-        # 初始化流量矩阵
-        flow_matrix = [[0] * self.n for _ in range(self.n)]
-        
-        # 计算自由流状态下的最短路径
-        _, path_matrix = self.floyd_warshall(self.time_link)
-        
-        # 对每个OD对进行全有全无分配
-        for origin, destination, demand in self.od_pairs:
-            path = self.get_path_from_path_matrix(path_matrix, origin, destination)
-            
-            # 将整个需求分配到最短路径上
-            for i in range(len(path) - 1):
-                from_node = path[i]
-                to_node = path[i + 1]
-                flow_matrix[from_node][to_node] += demand
-        
-        return flow_matrix
-    
-    def incremental_assignment(self, increments=4):
-        """增量分配算法"""
-        # 初始化流量矩阵
-        flow_matrix = [[0] * self.n for _ in range(self.n)]
-        
-        # 将每个OD对的需求分成若干份
-        for origin, destination, demand in self.od_pairs:
-            increment = demand / increments
-            
-            for inc in range(increments):
-                # 计算当前流量状态下的拥堵时间
-                congested_time = self.network.calculate_congested_time(flow_matrix)
-                
-                # 计算最短路径
-                _, path_matrix = self.floyd_warshall(congested_time)
-                
-                # 获取当前最短路径
-                path = self.get_path_from_path_matrix(path_matrix, origin, destination)
-                
-                # 将一份需求分配到当前最短路径上
-                for i in range(len(path) - 1):
-                    from_node = path[i]
-                    to_node = path[i + 1]
-                    flow_matrix[from_node][to_node] += increment
-        
-        return flow_matrix
-    
-    def frank_wolfe_assignment(self, max_iterations=10, convergence_threshold=0.01):
-        """Frank-Wolfe算法（用户均衡分配）"""
-        # 初始化流量矩阵
-        flow_matrix = [[0] * self.n for _ in range(self.n)]
-        
+
+    def get_tree_links(self, tree, destination):
+        """从最短路径树中提取到终点的有向弧编号序列（直接取树上的前驱弧，平行弧不会混淆）"""
+        _, pred, _ = tree
+        links = []
+        k = pred[destination]
+        while k != -1:
+            links.append(k)
+            k = pred[self.link_from[k]]
+        links.reverse()
+        return links
+
+    def get_path_links(self, path):
+        """将节点路径转换为有向弧编号序列（两节点间有平行弧时只能取到其中一条，树上的路径应使用get_tree_links）"""
+        return [self.network.get_link_index(path[i], path[i + 1]) for i in range(len(path) - 1)]
+
+    def _load_tree(self, tree, demand, link_flow, scale=1.0):
+        """沿最短路径树将一个起点的全部需求一次性加载到路段流量上"""
+        load_tree(self.link_from, tree, demand, link_flow, scale)
+
+    def _all_or_nothing_load(self, link_time, scale=1.0):
+        """在给定路段时间下执行一次全有全无加载，返回路段流量"""
+        if self._parallel is not None:
+            start = perf_counter()
+            link_flow = self._parallel.load(link_time, scale)
+            self.timings['parallel_load'] += perf_counter() - start
+            return link_flow
+        link_flow = [0.0] * self.m
+        for origin, tree in self._trees(link_time, self.origin_demand):
+            start = perf_counter()
+            self._load_tree(tree, self.origin_demand[origin], link_flow, scale)
+            self.timings['loading'] += perf_counter() - start
+        return np.array(link_flow)
+
+    def _all_or_nothing_paths(self, link_time, path_store=None, scale=1.0):
+        """全有全无加载并记录各OD对使用的路径，返回(路段流量, 路径流量)；不记录路径时路径流量为None"""
+        if path_store is None:
+            return self._all_or_nothing_load(link_time, scale), None
+        # 记录路径需要各起点的最短路径树，在主进程中串行加载
+        link_flow = [0.0] * self.m
+        path_flows = {}
+        for origin, tree in self._trees(link_time, self.origin_demand):
+            start = perf_counter()
+            self._load_tree(tree, self.origin_demand[origin], link_flow, scale)
+            path_store.tree_flows(origin, tree, self.origin_demand[origin], scale, path_flows)
+            self.timings['loading'] += perf_counter() - start
+        return np.array(link_flow), path_flows
+
+    def all_or_nothing_assignment(self, path_store=None):
+        """全有全无分配算法
+
+        path_store: PathStore，记录各OD对使用的路径及流量
+        """
+        # 在自由流状态下的最短路径树上，将各OD对的整个需求分配到最短路径上
+        link_flow, path_flows = self._all_or_nothing_paths(self.time_link, path_store)
+        if path_store is not None:
+            path_store.set_flows(path_flows)
+        return link_flow
+
+    def incremental_assignment(self, increments=4, schedule=None, monitor=None, path_store=None):
+        """增量分配算法，每步在同一组最短路径树上加载所有OD对的一份需求
+
+        schedule: 各步加载比例，如 [0.4, 0.3, 0.2, 0.1]；缺省时均分为increments份
+        monitor: SolverMonitor，逐步记录求解过程；要求提前停止时剩余需求在下一步一次性加载
+        path_store: PathStore，记录各OD对使用的路径及流量
+        """
+        if schedule is None:
+            schedule = [1.0 / increments] * increments
+        if abs(sum(schedule) - 1.0) > 1e-9 or min(schedule) < 0:
+            raise ValueError(f"增量分配比例之和必须为1且不能为负: {schedule}")
+
+        if monitor is not None:
+            monitor.start(self, 'incremental', schedule=list(schedule))
+
+        # 初始化流量向量
+        link_flow = self.network.zero_flow()
+        path_flows = {}
+
+        self.iterations = 0
+        for step, fraction in enumerate(schedule):
+            # 计算当前流量状态下的拥堵时间
+            start = perf_counter()
+            congested_time = self.network.calculate_congested_time(link_flow)
+            self.timings['cost_update'] += perf_counter() - start
+
+            # 每个起点计算一次最短路径树，将所有OD对的一份需求加载到当前最短路径上
+            step_flow, step_paths = self._all_or_nothing_paths(congested_time, path_store, fraction)
+            link_flow += step_flow
+            if path_store is not None:
+                path_flows = combine_flows([(1.0, path_flows), (1.0, step_paths)])
+            self.iterations = step + 1
+
+            if monitor is not None and monitor.iteration(self, link_flow, step_size=fraction):
+                # 提前停止：剩余需求在当前拥堵时间下一次性加载，保证流量满足需求
+                if step + 1 < len(schedule):
+                    congested_time = self.network.calculate_congested_time(link_flow)
+                    step_flow, step_paths = self._all_or_nothing_paths(congested_time, path_store,
+                                                                       sum(schedule[step + 1:]))
+                    link_flow += step_flow
+                    if path_store is not None:
+                        path_flows = combine_flows([(1.0, path_flows), (1.0, step_paths)])
+                    self.iterations += 1
+                break
+
+        if path_store is not None:
+            path_store.set_flows(path_flows)
+        if monitor is not None:
+            monitor.finish(self, link_flow)
+        return link_flow
+
+    def frank_wolfe_assignment(self, max_iterations=100, target_gap=1e-4, method='fw', warm_start=None,
+                               monitor=None, path_store=None, initial_flow=None):
+        """Frank-Wolfe算法（用户均衡分配），相对间隙小于target_gap时停止
+
+        method: 'fw' 标准Frank-Wolfe, 'cfw' 共轭Frank-Wolfe, 'bfw' 双共轭Frank-Wolfe
+        warm_start: load_state() 读取的求解状态，从该状态出发继续迭代
+        monitor: SolverMonitor，逐次迭代记录求解过程，回调可要求提前停止
+        path_store: PathStore，记录各OD对使用的路径及流量（路径流量与路段流量按同样的凸组合更新）
+        initial_flow: 满足当前需求的初始可行路段流量，从该流量出发迭代
+        """
+        if method not in ('fw', 'cfw', 'bfw'):
+            raise ValueError(f"未知的Frank-Wolfe方法: {method}")
+        if (warm_start is not None or initial_flow is not None) and path_store is not None:
+            raise ValueError("热启动的状态不含路径流量，无法记录路径")
+
+        path_flows = None
+        if initial_flow is not None:
+            link_flow = np.array(initial_flow, dtype=float)
+        elif warm_start is not None:
+            link_flow = self._warm_start_flow(warm_start)
+        else:
+            # 以自由流状态下的全有全无分配作为初始可行解
+            link_flow, path_flows = self._all_or_nothing_paths(self.time_link, path_store)
+        # 前两次迭代的搜索目标点和上一次步长（共轭方向使用），以及对应的路径流量
+        previous_target, earlier_target, previous_step = None, None, 0.0
+        previous_paths = earlier_paths = None
+
+        if monitor is not None:
+            monitor.start(self, method, max_iterations=max_iterations, target_gap=target_gap,
+                          warm_start=warm_start is not None or initial_flow is not None)
+        self.iterations = 0
         for iteration in range(max_iterations):
             # 计算当前流量状态下的拥堵时间
-            congested_time = self.network.calculate_congested_time(flow_matrix)
-            
-            # 计算最短路径
-            _, path_matrix = self.floyd_warshall(congested_time)
-            
-            # 执行一次全有全无分配得到辅助解
-            auxiliary_flow = [[0] * self.n for _ in range(self.n)]
-            for origin, destination, demand in self.od_pairs:
-                path = self.get_path_from_path_matrix(path_matrix, origin, destination)
-                for i in range(len(path) - 1):
-                    from_node = path[i]
-                    to_node = path[i + 1]
-                    auxiliary_flow[from_node][to_node] += demand
-            
+            start = perf_counter()
+            congested_time, derivative, objective, _ = self.network.evaluate_costs(link_flow)
+            self.timings['cost_update'] += perf_counter() - start
+
+            # 计算最短路径并执行一次全有全无分配得到辅助解
+            auxiliary_flow, auxiliary_paths = self._all_or_nothing_paths(congested_time, path_store)
+
+            # 检查收敛性
+            gap = self._relative_gap(congested_time, link_flow, auxiliary_flow)
+            stop = monitor is not None and monitor.iteration(self, link_flow, gap, previous_step if iteration else None,
+                                                             objective=objective)
+            if self._converged(gap, target_gap) or stop:
+                break
+            self.iterations = iteration + 1
+
+            # 确定搜索目标点（辅助解与前两次目标点的组合）
+            target_flow, weights = auxiliary_flow, (1.0, 0.0, 0.0)
+            if method != 'fw' and previous_target is not None:
+                weights = self._conjugate_weights(link_flow, derivative, auxiliary_flow, previous_target,
+                                                  earlier_target if method == 'bfw' else None, previous_step)
+                if weights[1] or weights[2]:
+                    target_flow = weights[0] * auxiliary_flow + weights[1] * previous_target
+                if weights[2]:
+                    target_flow = target_flow + weights[2] * earlier_target
+
             # 计算步长（线搜索）
-            step_size = self._calculate_optimal_step_size(flow_matrix, auxiliary_flow)
-            
+            start = perf_counter()
+            step_size = self._calculate_optimal_step_size(link_flow, target_flow)
+            self.timings['line_search'] += perf_counter() - start
+
             # 更新流量
-            new_flow_matrix = [[0] * self.n for _ in range(self.n)]
-            for i in range(self.n):
-                for j in range(self.n):
-                    new_flow_matrix[i][j] = (1 - step_size) * flow_matrix[i][j] + step_size * auxiliary_flow[i][j]
-            
-            # 检查收敛性
-            if self._check_convergence(flow_matrix, new_flow_matrix, convergence_threshold):
+            link_flow = link_flow + step_size * (target_flow - link_flow)
+            earlier_target, previous_target, previous_step = previous_target, target_flow, step_size
+
+            if path_store is not None:
+                target_paths = combine_flows([(weights[0], auxiliary_paths), (weights[1], previous_paths),
+                                              (weights[2], earlier_paths)])
+                path_flows = combine_flows([(1.0 - step_size, path_flows), (step_size, target_paths)])
+                earlier_paths, previous_paths = previous_paths, target_paths
+                path_store.maintain([path_flows, previous_paths, earlier_paths or {}])
+
+        if path_store is not None:
+            path_store.set_flows(path_flows)
+        if monitor is not None:
+            monitor.finish(self, link_flow)
+        return link_flow
+
+    def origin_based_assignment(self, max_iterations=100, target_gap=1e-8, inner_iterations=4, warm_start=None,
+                                monitor=None):
+        """基于起点的用户均衡算法（Algorithm B），为每个起点维护无环bush，适合高精度求解
+
+        warm_start: load_state() 读取的求解状态，需求未变或按比例变化的起点直接沿用保存的bush
+        monitor: SolverMonitor，逐次迭代记录求解过程，回调可要求提前停止
+        """
+        network = self.network
+        vdf = network.vdf
+        t0, capacity = network.free_flow_time.tolist(), network.link_capacity.tolist()
+
+        if warm_start is not None:
+            self.bushes = self._warm_start_bushes(warm_start)
+        else:
+            # 以自由流最短路径树初始化各起点的bush
+            free_flow_time = self.time_link.tolist()
+            self.bushes = {origin: Bush(self, origin, demand, free_flow_time)
+                           for origin, demand in self.origin_demand.items()}
+        link_flow = [0.0] * self.m
+        for bush in self.bushes.values():
+            for k, value in bush.flow.items():
+                link_flow[k] += value
+
+        link_time = network.calculate_congested_time(link_flow).tolist()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            link_derivative = vdf.derivative(network.free_flow_time, network.link_capacity, np.array(link_flow)).tolist()
+
+        def apply(k, delta):
+            # 更新单条弧的总流量及其行程时间和导数
+            link_flow[k] = max(link_flow[k] + delta, 0.0)
+            link_time[k] = vdf.time(t0[k], capacity[k], link_flow[k])
+            link_derivative[k] = vdf.derivative(t0[k], capacity[k], link_flow[k])
+
+        if monitor is not None:
+            monitor.start(self, 'origin_based', max_iterations=max_iterations, target_gap=target_gap,
+                          inner_iterations=inner_iterations, warm_start=warm_start is not None)
+        self.iterations = 0
+        for iteration in range(max_iterations):
+            current_flow = np.array(link_flow)
+            congested_time = np.array(link_time)
+            auxiliary_flow = self._all_or_nothing_load(congested_time)
+            gap = self._relative_gap(congested_time, current_flow, auxiliary_flow)
+            stop = monitor is not None and monitor.iteration(self, current_flow, gap)
+            if self._converged(gap, target_gap) or stop:
+                break
+            self.iterations = iteration + 1
+
+            # bush更新和流量转移（路段时间随流量转移逐弧更新）
+            start = perf_counter()
+            for bush in self.bushes.values():
+                bush.improve(link_time)
+                for _ in range(inner_iterations):
+                    bush.shift_flows(link_time, link_derivative, apply)
+            self.timings['bush_update'] += perf_counter() - start
+
+        link_flow = np.array(link_flow)
+        if monitor is not None:
+            monitor.finish(self, link_flow)
+        return link_flow
+
+    def _stochastic_load(self, link_time, theta):
+        """在给定路段时间下按Dial STOCH方法执行一次logit随机加载，返回路段流量"""
+        link_time_list = np.asarray(link_time, dtype=float).tolist()
+        link_flow = [0.0] * self.m
+        for origin, tree in self._trees(link_time, self.origin_demand):
+            start = perf_counter()
+            dial_load(self.first_out, self.link_to, link_time_list, tree, self.origin_demand[origin], link_flow, theta)
+            self.timings['loading'] += perf_counter() - start
+        return np.array(link_flow)
+
+    def stochastic_assignment(self, theta=0.5, max_iterations=100, tolerance=1e-4, monitor=None):
+        """随机用户均衡分配（logit模型）：Dial STOCH单次加载 + 相继平均法（MSA）
+
+        theta: logit离散参数（1/分钟），越大越接近确定性用户均衡
+        tolerance: 辅助流量与当前流量的相对差 ||y - x|| / ||x|| 小于该值时停止
+        monitor: SolverMonitor，逐次迭代记录求解过程（记录中的flow_change为上述相对差），回调可要求提前停止
+        """
+        if monitor is not None:
+            monitor.start(self, 'stochastic', theta=theta, max_iterations=max_iterations, tolerance=tolerance)
+
+        # 以自由流状态下的随机加载作为初始解
+        link_flow = self._stochastic_load(self.time_link, theta)
+
+        self.iterations = 0
+        for iteration in range(max_iterations):
+            start = perf_counter()
+            congested_time = self.network.calculate_congested_time(link_flow)
+            self.timings['cost_update'] += perf_counter() - start
+
+            auxiliary_flow = self._stochastic_load(congested_time, theta)
+            norm = np.linalg.norm(link_flow)
+            change = np.linalg.norm(auxiliary_flow - link_flow) / norm if norm > 0 else 0.0
+            step_size = 1.0 / (iteration + 1) if iteration else None
+            stop = monitor is not None and monitor.iteration(self, link_flow, step_size=step_size, flow_change=change)
+            if change < tolerance or stop:
                 break
-            
-            flow_matrix = new_flow_matrix
-        
-        return flow_matrix
-    
-    def _calculate_optimal_step_size(self, current_flow, auxiliary_flow):
-        """计算Frank-Wolfe算法的最优步长"""
-        # 简化的步长计算，实际应用中可能需要更复杂的线搜索
-        return 2.0 / (2.0 + len(self.od_pairs))
-    
-    def _check_convergence(self, old_flow, new_flow, threshold):
-        """检查算法是否收敛"""
-        total_diff = 0
-        total_flow = 0
-        for i in range(self.n):
-            for j in range(self.n):
-                total_diff += abs(new_flow[i][j] - old_flow[i][j])
-                total_flow += new_flow[i][j]
-        
-        if total_flow == 0:
-            return True
-        
-        return total_diff / total_flow < threshold
-    
-    def print_assignment_results(self, flow_matrix, algorithm_name):
+            self.iterations = iteration + 1
+
+            # 相继平均：第n次迭代步长为1/(n+1)
+            link_flow = link_flow + (auxiliary_flow - link_flow) / (iteration + 2)
+
+        if monitor is not None:
+            monitor.finish(self, link_flow)
+        return link_flow
+
+    def save_state(self, state_file, link_flow, bushes=None):
+        """保存求解状态（路段流量、对应需求，以及可选的各起点bush流量），供热启动使用"""
+        network = self.network
+        data = dict(names=np.array(self.names, dtype=str), link_from=network.link_from, link_to=network.link_to,
+                    link_flow=np.asarray(link_flow, dtype=float), demand_origin=network.demand_origin,
+                    demand_destination=network.demand_destination, demand_amount=network.demand_amount)
+        if bushes:
+            origins, links, flows = [], [], []
+            for origin, bush in bushes.items():
+                origins.extend([origin] * len(bush.flow))
+                links.extend(bush.flow.keys())
+                flows.extend(bush.flow.values())
+            data.update(bush_origin=np.array(origins, dtype=np.int32), bush_link=np.array(links, dtype=np.int32),
+                        bush_flow=np.array(flows, dtype=float))
+        np.savez(state_file, **data)
+
+    def load_state(self, state_file):
+        """读取求解状态，并按节点名称映射到当前网络（当前网络中不存在的路段被舍弃，舍弃的流量合计记在dropped_flow中）"""
+        network = self.network
+        with np.load(state_file) as data:
+            data = dict(data)
+
+        # 旧节点编号 -> 当前节点编号，旧有向弧编号 -> 当前有向弧编号（不存在时为-1）
+        node_map = np.array([network.name_index.get(name, -1) for name in data['names'].tolist()])
+        link_map = []
+        for i, j in zip(node_map[data['link_from']].tolist(), node_map[data['link_to']].tolist()):
+            k = network.get_link_index(i, j) if i >= 0 and j >= 0 else None
+            link_map.append(-1 if k is None else k)
+        link_map = np.array(link_map, dtype=np.int64)
+
+        valid = link_map >= 0
+        link_flow = np.zeros(self.m)
+        np.add.at(link_flow, link_map[valid], data['link_flow'][valid])
+        # 当前网络中已不存在的路段上的流量被舍弃，此时保存的流量不再满足需求守恒
+        dropped_flow = float(np.abs(data['link_flow'][~valid]).sum())
+
+        origin_demand = {}
+        for origin, destination, amount in zip(node_map[data['demand_origin']].tolist(),
+                                               node_map[data['demand_destination']].tolist(),
+                                               data['demand_amount'].tolist()):
+            demand = origin_demand.setdefault(origin, {})
+            demand[destination] = demand.get(destination, 0.0) + amount
+
+        bushes = None
+        if 'bush_origin' in data:
+            bushes = {}
+            for origin, k, value in zip(node_map[data['bush_origin']].tolist(), link_map[data['bush_link']].tolist(),
+                                        data['bush_flow'].tolist()):
+                bush = bushes.setdefault(origin, {})
+                if bush is not None and k >= 0:
+                    bush[k] = value
+                else:
+                    # bush中有路段已被删除，该起点需重新构建
+                    bushes[origin] = None
+
+        return {'link_flow': link_flow, 'origin_demand': origin_demand, 'bushes': bushes, 'dropped_flow': dropped_flow}
+
+    def _demand_scale(self, origin, saved_demand):
+        """若某起点当前需求与保存时的需求成比例（终点集合相同），返回比例系数，否则返回None"""
+        saved = saved_demand.get(origin)
+        if origin not in self.origin_demand or not saved:
+            return None
+        current = {}
+        destinations, amounts = self.origin_demand[origin]
+        for destination, amount in zip(destinations.tolist(), amounts.tolist()):
+            current[destination] = current.get(destination, 0.0) + amount
+        if current.keys() != saved.keys() or sum(saved.values()) <= 0:
+            return None
+
+        scale = sum(current.values()) / sum(saved.values())
+        for destination, amount in current.items():
+            if abs(amount - scale * saved[destination]) > 1e-9 * max(abs(amount), 1.0):
+                return None
+        return scale
+
+    def _warm_start_flow(self, warm_start):
+        """由保存的状态构造与当前需求一致的可行初始流量"""
+        saved_flow = warm_start['link_flow']
+        bushes = warm_start['bushes']
+        saved_demand = warm_start['origin_demand']
+
+        # 没有bush时只能整体缩放：所有起点需求按同一比例变化，保存的流量没有被舍弃的部分，且未使用已关闭的路段
+        if not bushes:
+            scales = {self._demand_scale(origin, saved_demand) for origin in self.origin_demand}
+            if len(scales) == 1 and None not in scales and saved_demand.keys() == self.origin_demand.keys() \
+                    and not warm_start.get('dropped_flow', 0.0) \
+                    and not np.any((saved_flow > 0) & (self.network.link_capacity <= 0)):
+                return scales.pop() * saved_flow
+            # 需求结构改变时，在保存状态的拥堵时间下做一次全有全无加载
+            return self._all_or_nothing_load(self.network.calculate_congested_time(saved_flow))
+
+        # 有bush时逐起点处理：需求成比例的起点沿用bush流量，其余起点在保存状态的拥堵时间下加载
+        link_time = self.network.calculate_congested_time(saved_flow).tolist()
+        link_flow = [0.0] * self.m
+        for origin, demand in self.origin_demand.items():
+            scale = self._demand_scale(origin, saved_demand)
+            if scale is not None and self._bush_usable(bushes.get(origin)):
+                for k, value in bushes[origin].items():
+                    link_flow[k] += scale * value
+            else:
+                self._load_tree(self._dijkstra(link_time, origin), demand, link_flow)
+        return np.array(link_flow)
+
+    def _bush_usable(self, bush):
+        """保存的bush能否沿用：bush非空且不含通行能力为0（已关闭）的路段"""
+        capacity = self.network.link_capacity
+        return bool(bush) and all(capacity[k] > 0 for k in bush)
+
+    def _warm_start_bushes(self, warm_start):
+        """由保存的状态恢复各起点的bush，需求结构改变或bush经过已关闭路段的起点在保存状态的拥堵时间下重新构建"""
+        bushes = warm_start['bushes'] or {}
+        link_time = self.network.calculate_congested_time(warm_start['link_flow']).tolist()
+        result = {}
+        for origin, demand in self.origin_demand.items():
+            scale = self._demand_scale(origin, warm_start['origin_demand'])
+            if scale is not None and self._bush_usable(bushes.get(origin)):
+                flow = {k: scale * value for k, value in bushes[origin].items()}
+                result[origin] = Bush(self, origin, demand, link_time, flow)
+            else:
+                result[origin] = Bush(self, origin, demand, link_time)
+        return result
+
+    def _conjugate_weights(self, link_flow, derivative, auxiliary_flow, previous_target, earlier_target,
+                           previous_step):
+        """计算共轭(CFW)或双共轭(BFW)方向的搜索目标点系数(辅助解, 上次目标点, 前次目标点)，
+        共轭系数由当前流量处的Hessian对角元（路段时间导数derivative）确定"""
+        hessian = np.where(np.isfinite(derivative), derivative, 0.0)
+        direction = auxiliary_flow - link_flow
+        previous_direction = previous_target - link_flow
+
+        # 上一步步长为1时共轭方向退化，使用标准Frank-Wolfe方向
+        if previous_step >= 1.0 - 1e-12:
+            return 1.0, 0.0, 0.0
+
+        if earlier_target is None or previous_step <= 0:
+            # 共轭Frank-Wolfe: 新方向与上一方向关于Hessian共轭
+            numerator = np.dot(previous_direction * hessian, direction)
+            denominator = np.dot(previous_direction * hessian, auxiliary_flow - previous_target)
+            weight = numerator / denominator if denominator != 0 else 0.0
+            weight = min(max(weight, 0.0), 1.0 - 0.01)
+            return 1 - weight, weight, 0.0
+
+        # 双共轭Frank-Wolfe: 新方向与前两个方向均共轭
+        earlier_direction = previous_step * previous_target - link_flow + (1 - previous_step) * earlier_target
+        denominator = np.dot(earlier_direction * hessian, earlier_target - previous_target)
+        mu = -np.dot(earlier_direction * hessian, direction) / denominator if denominator != 0 else 0.0
+        mu = max(mu, 0.0)
+        denominator = np.dot(previous_direction * hessian, previous_direction)
+        nu = -np.dot(previous_direction * hessian, direction) / denominator if denominator != 0 else 0.0
+        nu = max(nu + mu * previous_step / (1 - previous_step), 0.0)
+
+        beta = 1.0 / (1.0 + nu + mu)
+        return beta, nu * beta, mu * beta
+
+    def _calculate_optimal_step_size(self, current_flow, auxiliary_flow, tolerance=1e-10, max_steps=50):
+        """沿搜索方向对Beckmann目标函数做精确线搜索（牛顿法，二分法保护）"""
+        direction = auxiliary_flow - current_flow
+        moving = direction != 0
+        if not moving.any():
+            return 0.0
+
+        vdf = self.network.vdf
+        t0 = self.network.free_flow_time[moving]
+        capacity = self.network.link_capacity[moving]
+        flow, direction = current_flow[moving], direction[moving]
+
+        def slope(step):
+            # 目标函数沿方向的导数: sum(t(x + step*d) * d)
+            return np.dot(vdf.time(t0, capacity, flow + step * direction), direction)
+
+        def curvature(step):
+            return np.dot(vdf.derivative(t0, capacity, flow + step * direction), direction ** 2)
+
+        if slope(1.0) <= 0:
+            return 1.0
+        if slope(0.0) >= 0:
+            return 0.0
+
+        low, high = 0.0, 1.0
+        step = 0.5
+        for _ in range(max_steps):
+            value = slope(step)
+            if value > 0:
+                high = step
+            else:
+                low = step
+
+            second = curvature(step)
+            new_step = step - value / second if second > 0 else -1.0
+            if not low < new_step < high:
+                new_step = (low + high) / 2
+            if abs(new_step - step) < tolerance:
+                return new_step
+            step = new_step
+
+        return step
+
+    def _relative_gap(self, link_time, link_flow, auxiliary_flow):
+        """相对间隙: (当前总出行时间 - 最短路总出行时间) / 当前总出行时间"""
+        used = (link_flow > 0) | (auxiliary_flow > 0)
+        total_time = np.dot(link_time[used], link_flow[used])
+        shortest_time = np.dot(link_time[used], auxiliary_flow[used])
+        if total_time <= 0:
+            return 0.0
+        return (total_time - shortest_time) / total_time
+
+    @staticmethod
+    def _converged(gap, target_gap):
+        """相对间隙是否达到收敛标准；明显为负的间隙说明当前流量不满足需求守恒（不可行），不视为收敛"""
+        return -1e-9 < gap < target_gap
+
+    def relative_gap(self, link_flow):
+        """计算给定路段流量的相对间隙"""
+        congested_time = self.network.calculate_congested_time(link_flow)
+        return self._relative_gap(congested_time, link_flow, self._all_or_nothing_load(congested_time))
+
+    def average_excess_cost(self, link_flow):
+        """计算平均超额费用: (当前总出行时间 - 最短路总出行时间) / 总需求"""
+        congested_time = self.network.calculate_congested_time(link_flow)
+        auxiliary_flow = self._all_or_nothing_load(congested_time)
+        total_demand = self.network.demand_amount.sum()
+        gap = self._relative_gap(congested_time, link_flow, auxiliary_flow)
+        return gap * np.dot(congested_time[link_flow > 0], link_flow[link_flow > 0]) / total_demand
+
+    def print_assignment_results(self, link_flow, algorithm_name):
         """打印分配结果"""
         print(f"\n=== {algorithm_name}分配结果 ===")
-        
+
         # 打印各路段流量
         print("\n各路段流量:")
-        for i in range(self.n):
-            for j in range(i + 1, self.n):
-                if self.adjacency[i][j] and flow_matrix[i][j] > 0:
-                    print(f"{self.names[i]}-{self.names[j]}: {flow_matrix[i][j]:.1f} 辆/小时")
-        
+        for k in np.flatnonzero(link_flow > 0):
+            i, j = self.link_from[k], self.link_to[k]
+            if i < j:
+                print(f"{self.names[i]}-{self.names[j]}: {link_flow[k]:.1f} 辆/小时")
+
         # 计算总出行时间
-        total_time = self.network.calculate_total_travel_time(flow_matrix)
+        total_time = self.network.calculate_total_travel_time(link_flow)
         print(f"\n路网总出行时间: {total_time:.1f} 分钟")
-        
+        print(f"相对间隙: {self.relative_gap(link_flow):.2e}")
+
         # 打印各OD对的路径和时间
         print("\n各OD对路径和行程时间:")
-        congested_time = self.network.calculate_congested_time(flow_matrix)
-        _, path_matrix = self.floyd_warshall(congested_time)
-        
+        congested_time = self.network.calculate_congested_time(link_flow)
+        trees = self.shortest_path_trees(congested_time)
+
         for origin, destination, demand in self.od_pairs:
-            path = self.get_path_from_path_matrix(path_matrix, origin, destination)
+            path = self.get_path_from_tree(trees[origin], destination)
             path_names = [self.names[node] for node in path]
-            
+
             # 计算路径总时间
-            path_time = 0
-            for i in range(len(path) - 1):
-                path_time += congested_time[path[i]][path[i + 1]]
-            
+            path_time = sum(congested_time[k] for k in self.get_tree_links(trees[origin], destination))
+
             print(f"{self.names[origin]} → {self.names[destination]}: 需求={demand}, "
-                  f"路径={'→'.join(path_names)}, 时间={path_time:.1f}分钟")
\ No newline at end of file
+                  f"路径={'→'.join(path_names)}, 时间={path_time:.1f}分钟")
@@ -0,0 +1,171 @@
+import copy
+import csv
+import json
+import os
+import sys
+from multiprocessing import Pool
+import numpy as np
+from algorithms import TrafficAssignment
+from datas import Network
+
+# 工作进程共享的基础网络，由_init_worker设置
+_base = {}
+
+
+def edge_lookup(network):
+    """路段名称 -> 路段编号，支持 "BE"、"B-E" 两种写法及反向写法"""
+    lookup = {}
+    for z, (c1, c2) in enumerate(network.between):
+        for a, b in ((c1, c2), (c2, c1)):
+            lookup[f"{a}{b}"] = lookup[f"{a}-{b}"] = z
+    return lookup
+
+
+def apply_scenario(base, scenario, lookup=None):
+    """生成场景网络：浅复制基础网络，只替换被场景修改的数组，其余数据与基础网络共享
+
+    scenario 可包含:
+      demand_factor:   全部需求的放大系数
+      demand:          {起点: {终点: 需求量}} 修改（或新增）的OD需求，在demand_factor之后应用
+      capacity:        {路段: 通行能力}
+      capacity_factor: {路段: 通行能力系数}
+      closed:          [路段, ...] 关闭的路段（通行能力置0）
+    """
+    lookup = lookup or edge_lookup(base)
+    network = copy.copy(base)
+
+    if 'demand_factor' in scenario:
+        network.demand_amount = base.demand_amount * scenario['demand_factor']
+
+    if 'demand' in scenario:
+        origin, destination = base.demand_origin.tolist(), base.demand_destination.tolist()
+        pairs = {(i, j): r for r, (i, j) in enumerate(zip(origin, destination))}
+        amount = network.demand_amount.astype(float).tolist()
+        for a, row in scenario['demand'].items():
+            for b, value in row.items():
+                i, j = base.get_node_index(a), base.get_node_index(b)
+                if (i, j) in pairs:
+                    amount[pairs[(i, j)]] = value
+                else:
+                    pairs[(i, j)] = len(amount)
+                    origin.append(i)
+                    destination.append(j)
+                    amount.append(value)
+        network.demand_origin = np.array(origin, dtype=base.demand_origin.dtype)
+        network.demand_destination = np.array(destination, dtype=base.demand_destination.dtype)
+        network.demand_amount = np.array(amount)
+
+    if any(key in scenario for key in ('capacity', 'capacity_factor', 'closed')):
+        edge_capacity = np.full(len(base.edge_nodes), np.nan)
+        edge_factor = np.ones(len(base.edge_nodes))
+        for key, value in scenario.get('capacity', {}).items():
+            edge_capacity[lookup[key]] = value
+        for key, value in scenario.get('capacity_factor', {}).items():
+            edge_factor[lookup[key]] = value
+        for key in scenario.get('closed', []):
+            edge_capacity[lookup[key]] = 0.0
+
+        link_capacity = edge_capacity[base.link_edge]
+        link_capacity = np.where(np.isnan(link_capacity), base.link_capacity, link_capacity)
+        network.link_capacity = link_capacity * edge_factor[base.link_edge]
+
+    return network
+
+
+def solve(network, settings, warm_start=None):
+    """按配置对场景网络执行一次分配，返回路段流量
+
+    warm_start: 与load_state()格式相同的求解状态，Frank-Wolfe类和基于起点的算法从该状态出发迭代
+    """
+    assignment = TrafficAssignment(network)
+    method = settings.get('method', 'bfw')
+    max_iterations = settings.get('max_iterations', 100)
+    if method in ('fw', 'cfw', 'bfw'):
+        return assignment, assignment.frank_wolfe_assignment(max_iterations, settings.get('target_gap', 1e-4), method,
+                                                             warm_start)
+    if method == 'origin_based':
+        return assignment, assignment.origin_based_assignment(max_iterations, settings.get('target_gap', 1e-8),
+                                                              warm_start=warm_start)
+    if method == 'incremental':
+        return assignment, assignment.incremental_assignment(schedule=settings.get('schedule'))
+    if method == 'stochastic':
+        return assignment, assignment.stochastic_assignment(settings.get('theta', 0.5), max_iterations,
+                                                            settings.get('tolerance', 1e-4))
+    if method == 'all_or_nothing':
+        return assignment, assignment.all_or_nothing_assignment()
+    raise ValueError(f"未知的分配方法: {method}")
+
+
+def _init_worker(network, settings):
+    """工作进程初始化：每个进程只接收一次基础网络"""
+    _base['network'] = network
+    _base['settings'] = settings
+    _base['lookup'] = edge_lookup(network)
+
+
+def _run_scenario(scenario):
+    """在工作进程中运行单个场景，返回(场景名, 路段流量, 路段时间, 总出行时间, 相对间隙)"""
+    network = apply_scenario(_base['network'], scenario, _base['lookup'])
+    settings = dict(_base['settings'], **scenario.get('settings', {}))
+    assignment, link_flow = solve(network, settings)
+    link_time = network.calculate_congested_time(link_flow)
+    return (scenario['name'], link_flow, link_time, network.calculate_total_travel_time(link_flow),
+            assignment.relative_gap(link_flow))
+
+
+def run_batch(manifest_file):
+    """读取场景清单，基础网络只加载一次，多进程并行运行各场景并写出列式结果表"""
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    root = os.path.dirname(os.path.abspath(manifest_file))
+    network = Network(os.path.join(root, manifest['network']), os.path.join(root, manifest['demand']),
+                      cache_dir=os.path.join(root, manifest.get('cache_dir', '.cache')))
+    settings = manifest.get('settings', {})
+    scenarios = manifest['scenarios']
+
+    workers = min(manifest.get('workers') or os.cpu_count(), len(scenarios))
+    if workers > 1:
+        with Pool(workers, initializer=_init_worker, initargs=(network, settings)) as pool:
+            results = pool.map(_run_scenario, scenarios)
+    else:
+        _init_worker(network, settings)
+        results = [_run_scenario(scenario) for scenario in scenarios]
+
+    output_file = os.path.join(root, manifest.get('output', 'output/scenarios.npz'))
+    write_results(output_file, network, results)
+    return output_file, results
+
+
+def write_results(output_file, network, results):
+    """写出结果表：.npz 为列式数组（场景×路段），.csv 为长表"""
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    names = np.array(network.names, dtype=str)
+    link_from, link_to = names[network.link_from], names[network.link_to]
+    scenario_names = [name for name, *_ in results]
+
+    if output_file.endswith('.csv'):
+        with open(output_file, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['scenario', 'from', 'to', 'flow', 'time'])
+            for name, link_flow, link_time, _, _ in results:
+                writer.writerows(zip([name] * network.m, link_from, link_to, link_flow.round(3), link_time.round(4)))
+        return
+
+    np.savez_compressed(output_file, scenario=np.array(scenario_names, dtype=str), link_from=link_from,
+                        link_to=link_to, flow=np.array([result[1] for result in results]),
+                        time=np.array([result[2] for result in results]),
+                        total_travel_time=np.array([result[3] for result in results]),
+                        relative_gap=np.array([result[4] for result in results]))
+
+
+def main():
+    """命令行入口: python batch.py scenarios.json"""
+    manifest_file = sys.argv[1] if len(sys.argv) > 1 else 'scenarios.json'
+    output_file, results = run_batch(manifest_file)
+    for name, _, _, total_time, gap in results:
+        print(f"{name}: 路网总出行时间={total_time:.1f} 分钟, 相对间隙={gap:.2e}")
+    print(f"\n结果已保存到 {output_file}")
+
+
+if __name__ == "__main__":
+    main()
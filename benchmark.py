@@ -0,0 +1,346 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from math import ceil, sqrt
+import numpy as np
+from algorithms import TrafficAssignment
+from contraction import ContractedNetwork
+from datas import Network
+from delay_functions import BPRDelay
+
+SOLVERS = ('fw', 'cfw', 'bfw', 'origin_based', 'incremental')
+
+
+def _two_way(pairs, x, y, rng):
+    """将无向路段展开为双向有向弧，随机生成限速和通行能力，返回(起点, 终点, 自由流时间, 通行能力)"""
+    link_from, link_to, free_flow_time, capacity = [], [], [], []
+    for i, j in pairs:
+        distance = sqrt((x[i] - x[j]) ** 2 + (y[i] - y[j]) ** 2)
+        speed = rng.choice([30, 60])
+        road_capacity = rng.choice([900, 1800, 3600])
+        for a, b in ((i, j), (j, i)):
+            link_from.append(a)
+            link_to.append(b)
+            free_flow_time.append(60 * distance / speed)
+            capacity.append(road_capacity)
+    return link_from, link_to, free_flow_time, capacity
+
+
+def random_demand(n, pairs, seed=0, low=20, high=200):
+    """随机生成OD需求 (起点数组, 终点数组, 需求量数组)，起终点不同"""
+    rng = np.random.default_rng(seed)
+    origin = rng.integers(0, n, pairs)
+    destination = (origin + rng.integers(1, n, pairs)) % n
+    return origin, destination, rng.integers(low, high, pairs).astype(float)
+
+
+def grid_network(rows, cols, pairs, seed=0, vdf=None):
+    """生成rows×cols方格路网（相邻节点间距1km）和随机OD需求"""
+    rng = random.Random(seed)
+    names = [f"{r}_{c}" for r in range(rows) for c in range(cols)]
+    x = [c for r in range(rows) for c in range(cols)]
+    y = [r for r in range(rows) for c in range(cols)]
+    roads = []
+    for r in range(rows):
+        for c in range(cols):
+            i = r * cols + c
+            if c + 1 < cols:
+                roads.append((i, i + 1))
+            if r + 1 < rows:
+                roads.append((i, i + cols))
+    links = _two_way(roads, x, y, rng)
+    return Network.from_links(names, x, y, *links, random_demand(len(names), pairs, seed), vdf)
+
+
+def planar_network(nodes, pairs, seed=0, keep=0.6, diagonal=0.2, vdf=None):
+    """生成随机平面路网：扰动网格节点，保留随机生成树并以概率keep保留其余网格边，每个格子以概率diagonal加一条对角线"""
+    rng = random.Random(seed)
+    side = ceil(sqrt(nodes))
+    names = [str(i) for i in range(side * side)]
+    x = [c + rng.uniform(-0.3, 0.3) for r in range(side) for c in range(side)]
+    y = [r + rng.uniform(-0.3, 0.3) for r in range(side) for c in range(side)]
+
+    candidates = []
+    for r in range(side):
+        for c in range(side):
+            i = r * side + c
+            if c + 1 < side:
+                candidates.append((i, i + 1))
+            if r + 1 < side:
+                candidates.append((i, i + side))
+    rng.shuffle(candidates)
+
+    # 并查集生成随机生成树，保证连通
+    parent = list(range(len(names)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    roads = []
+    for i, j in candidates:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[root_i] = root_j
+            roads.append((i, j))
+        elif rng.random() < keep:
+            roads.append((i, j))
+
+    # 每个格子至多一条对角线，保持平面性
+    for r in range(side - 1):
+        for c in range(side - 1):
+            if rng.random() < diagonal:
+                i = r * side + c
+                roads.append((i, i + side + 1) if rng.random() < 0.5 else (i + 1, i + side))
+
+    links = _two_way(roads, x, y, rng)
+    return Network.from_links(names, x, y, *links, random_demand(len(names), pairs, seed), vdf)
+
+
+def _read_tntp_metadata(lines):
+    """读取TNTP文件头部 <KEY> value 元数据，返回(元数据, 正文起始行号)"""
+    metadata = {}
+    for number, line in enumerate(lines):
+        line = line.strip()
+        if line.startswith('<END OF METADATA>'):
+            return metadata, number + 1
+        if line.startswith('<'):
+            key, _, value = line[1:].partition('>')
+            metadata[key.strip()] = value.strip()
+    return metadata, 0
+
+
+def load_tntp(net_file, trips_file, node_file=None):
+    """读取TNTP格式的 _net.tntp / _trips.tntp（可选 _node.tntp 坐标）文件，拥堵函数为文件给出的BPR函数
+
+    编号小于第一个过境节点（FIRST THRU NODE）的节点不允许车辆穿过：每个这样的节点拆为只有入弧、
+    作为终点的原节点和只有出弧、作为起点的副本（名称加后缀"_out"）。
+    """
+    with open(net_file, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    metadata, start = _read_tntp_metadata(lines)
+    n = int(metadata['NUMBER OF NODES'])
+    first_thru = int(metadata.get('FIRST THRU NODE', 1)) - 1
+
+    link_from, link_to, capacity, free_flow_time, b, power = [], [], [], [], [], []
+    for line in lines[start:]:
+        line = line.strip()
+        if not line or line.startswith('~'):
+            continue
+        fields = line.rstrip(';').split()
+        link_from.append(int(fields[0]) - 1)
+        link_to.append(int(fields[1]) - 1)
+        capacity.append(float(fields[2]))
+        free_flow_time.append(float(fields[4]))
+        b.append(float(fields[5]))
+        power.append(float(fields[6]))
+    if len(set(b)) > 1 or len(set(power)) > 1:
+        raise ValueError(f"{net_file} 中各路段的BPR参数不一致，暂不支持")
+
+    origin, destination, amount = [], [], []
+    with open(trips_file, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    _, start = _read_tntp_metadata(lines)
+    current = None
+    for line in lines[start:]:
+        line = line.strip()
+        if line.startswith('Origin'):
+            current = int(line.split()[1]) - 1
+            continue
+        for entry in line.split(';'):
+            if ':' not in entry:
+                continue
+            to_node, value = entry.split(':')
+            if float(value) > 0 and int(to_node) - 1 != current:
+                origin.append(current)
+                destination.append(int(to_node) - 1)
+                amount.append(float(value))
+
+    x, y = [0.0] * n, [0.0] * n
+    if node_file:
+        with open(node_file, 'r', encoding='utf-8') as f:
+            for line in f.readlines()[1:]:
+                fields = line.rstrip(';\n').split()
+                if len(fields) >= 3:
+                    node = int(fields[0]) - 1
+                    x[node], y[node] = float(fields[1]), float(fields[2])
+
+    names = [str(i + 1) for i in range(n)]
+    # 非过境节点的出弧和出发需求移到其副本（编号n, n+1, ...）上
+    if first_thru > 0:
+        names += [f"{i + 1}_out" for i in range(first_thru)]
+        x, y = x + x[:first_thru], y + y[:first_thru]
+        link_from = [n + i if i < first_thru else i for i in link_from]
+        origin = [n + i if i < first_thru else i for i in origin]
+    return Network.from_links(names, x, y, link_from, link_to, free_flow_time, capacity,
+                              (origin, destination, amount), BPRDelay(b[0], power[0]))
+
+
+def _memory_usage():
+    """读取当前进程的常驻内存和峰值常驻内存（MB），仅Linux可用"""
+    usage = {}
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith(('VmRSS', 'VmHWM')):
+                key, value = line.split(':')
+                usage[key] = int(value.split()[0]) / 1024
+    return usage['VmRSS'], usage['VmHWM']
+
+
+def _run_solver(network, solver, target_gap, max_iterations, traced=False):
+    """运行单个求解器，返回各阶段用时、迭代次数和最终相对间隙"""
+    record = {'solver': solver}
+    start = time.perf_counter()
+    assignment = TrafficAssignment(network, tree_cache_mb=0)
+    record['setup_time'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assignment.all_or_nothing_assignment()
+    record['aon_time'] = time.perf_counter() - start
+
+    timings = dict(assignment.timings)
+    start = time.perf_counter()
+    if solver == 'origin_based':
+        link_flow = assignment.origin_based_assignment(max_iterations, target_gap)
+    elif solver == 'incremental':
+        link_flow = assignment.incremental_assignment()
+    else:
+        link_flow = assignment.frank_wolfe_assignment(max_iterations, target_gap, solver)
+    record['solve_time'] = time.perf_counter() - start
+    record['phase_time'] = {key: value - timings[key] for key, value in assignment.timings.items()}
+
+    record['iterations'] = assignment.iterations
+    record['relative_gap'] = float(assignment.relative_gap(link_flow))
+    record['total_travel_time'] = float(network.calculate_total_travel_time(link_flow))
+    record['timing_traced'] = traced
+    return record
+
+
+def _child(connection, network, solver, target_gap, max_iterations):
+    """子进程中运行求解器，并测量求解期间的峰值内存增量"""
+    baseline, _ = _memory_usage()
+    record = _run_solver(network, solver, target_gap, max_iterations)
+    _, peak = _memory_usage()
+    record['peak_memory_mb'] = peak - baseline
+    connection.send(record)
+    connection.close()
+
+
+def measure(network, solver, target_gap, max_iterations):
+    """测量一个求解器：Linux上在fork子进程中运行以隔离峰值内存，其他平台用tracemalloc统计（用时会偏大）"""
+    if os.path.exists('/proc/self/status') and 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_child, args=(sender, network, solver, target_gap, max_iterations))
+        process.start()
+        record = receiver.recv()
+        process.join()
+        return record
+
+    tracemalloc.start()
+    record = _run_solver(network, solver, target_gap, max_iterations, traced=True)
+    record['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return record
+
+
+def _version():
+    """当前代码版本（git提交号），不可用时返回None"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _previous_results(results_file, case):
+    """读取同一算例各求解器最近一次的结果"""
+    previous = {}
+    if os.path.exists(results_file):
+        with open(results_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record['case'] == case:
+                    previous[record['solver']] = record
+    return previous
+
+
+def run_benchmark(case, network, solvers=SOLVERS, target_gap=1e-4, max_iterations=200,
+                  results_file='benchmarks/results.jsonl'):
+    """对一个算例运行各求解器，结果追加到JSON-lines文件，并与上次结果比较"""
+    previous = _previous_results(results_file, case)
+    os.makedirs(os.path.dirname(results_file) or '.', exist_ok=True)
+    version, timestamp = _version(), datetime.now().isoformat(timespec='seconds')
+
+    print(f"算例 {case}: 节点 {network.n}, 有向弧 {network.m}, OD对 {len(network.demand_amount)}")
+    records = []
+    for solver in solvers:
+        record = measure(network, solver, target_gap, max_iterations)
+        record.update(case=case, nodes=network.n, links=network.m, od_pairs=len(network.demand_amount),
+                      target_gap=target_gap, version=version, timestamp=timestamp, python=platform.python_version())
+        records.append(record)
+        with open(results_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        line = (f"  {solver:<13} 求解 {record['solve_time']:8.2f}s  全有全无 {record['aon_time']:6.3f}s  "
+                f"最短路 {record['phase_time']['shortest_path']:8.2f}s  迭代 {record['iterations']:4d}  相对间隙 {record['relative_gap']:.2e}  "
+                f"峰值内存 {record['peak_memory_mb']:7.1f}MB")
+        if solver in previous:
+            old = previous[solver]
+            line += f"  (上次 {old['solve_time']:.2f}s @ {old.get('version')}, {record['solve_time'] / old['solve_time']:.2f}x)"
+        print(line)
+    return records
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='交通分配求解器性能测试')
+    parser.add_argument('kind', choices=['grid', 'planar', 'tntp'], help='算例类型')
+    parser.add_argument('files', nargs='*', help='tntp: _net.tntp _trips.tntp [_node.tntp]')
+    parser.add_argument('--size', type=int, default=20, help='grid: 每边节点数; planar: 节点数')
+    parser.add_argument('--pairs', type=int, default=500, help='合成算例的OD对数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--solvers', default=','.join(SOLVERS))
+    parser.add_argument('--target-gap', type=float, default=1e-4)
+    parser.add_argument('--max-iterations', type=int, default=200)
+    parser.add_argument('--output', default='benchmarks/results.jsonl')
+    parser.add_argument('--contract', action='store_true', help='在收缩后的网络上求解')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.kind == 'grid':
+        network = grid_network(args.size, args.size, args.pairs, args.seed)
+        case = f"grid{args.size}x{args.size}_od{args.pairs}_s{args.seed}"
+    elif args.kind == 'planar':
+        network = planar_network(args.size, args.pairs, args.seed)
+        case = f"planar{args.size}_od{args.pairs}_s{args.seed}"
+    else:
+        if len(args.files) < 2:
+            parser.error('tntp 需要 _net.tntp 和 _trips.tntp 文件')
+        network = load_tntp(*args.files[:3])
+        case = os.path.basename(args.files[0]).replace('_net.tntp', '')
+    print(f"网络构建用时 {time.perf_counter() - start:.2f}s")
+
+    if args.contract:
+        start = time.perf_counter()
+        contracted = ContractedNetwork(network)
+        stats = contracted.summary()
+        print(f"网络收缩用时 {time.perf_counter() - start:.2f}s: 节点 {stats['nodes']} → {stats['reduced_nodes']}, "
+              f"有向弧 {stats['links']} → {stats['reduced_links']}")
+        network = contracted.reduced
+        case += '_contracted'
+
+    run_benchmark(case, network, args.solvers.split(','), args.target_gap, args.max_iterations, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+from math import inf
+
+
+class Bush:
+    """以单个起点为根的无环子网络（bush），记录该起点在各有向弧上的流量"""
+
+    def __init__(self, assignment, origin, demand, link_time, flow=None):
+        self.assignment = assignment
+        self.origin = origin
+        self.demand = demand # (终点编号数组, 需求量数组)
+        self.flow = {} # 有向弧编号 -> 该起点在此弧上的流量
+
+        # 热启动时直接使用保存的bush流量
+        if flow is not None:
+            self.flow = dict(flow)
+            return
+
+        # 以给定路段时间下的最短路径树作为初始bush，并将全部需求加载在树上
+        tree = assignment._dijkstra(link_time, origin)
+        tree_flow = [0.0] * assignment.m
+        assignment._load_tree(tree, demand, tree_flow)
+        for k in tree[1]:
+            if k != -1:
+                self.flow[k] = tree_flow[k]
+
+    def _labels(self, link_time, epsilon=1e-9):
+        """按拓扑顺序计算最短/最长路标号，返回(拓扑序, 最短路前驱, 已用弧最长路前驱, 最长路距离)"""
+        n = self.assignment.n
+        link_from, link_to = self.assignment.link_from, self.assignment.link_to
+        incoming = [[] for _ in range(n)]
+        outgoing = [[] for _ in range(n)]
+        for k in self.flow:
+            incoming[link_to[k]].append(k)
+            outgoing[link_from[k]].append(k)
+
+        # Kahn拓扑排序（bush无环）
+        indegree = [len(links) for links in incoming]
+        order = [self.origin]
+        for i in order:
+            for k in outgoing[i]:
+                j = link_to[k]
+                indegree[j] -= 1
+                if indegree[j] == 0:
+                    order.append(j)
+
+        min_dist = [inf] * n
+        max_dist = [-inf] * n # 经过bush内全部弧的最长路
+        used_dist = [-inf] * n # 仅经过有流量弧的最长路
+        min_pred = [-1] * n
+        max_pred = [-1] * n
+        min_dist[self.origin] = max_dist[self.origin] = used_dist[self.origin] = 0.0
+        for j in order[1:]:
+            for k in incoming[j]:
+                i = link_from[k]
+                if min_dist[i] + link_time[k] < min_dist[j]:
+                    min_dist[j] = min_dist[i] + link_time[k]
+                    min_pred[j] = k
+                if max_dist[i] + link_time[k] > max_dist[j]:
+                    max_dist[j] = max_dist[i] + link_time[k]
+                if self.flow[k] > epsilon and used_dist[i] + link_time[k] > used_dist[j]:
+                    used_dist[j] = used_dist[i] + link_time[k]
+                    max_pred[j] = k
+        return order, min_pred, max_pred, max_dist
+
+    def improve(self, link_time, epsilon=1e-9):
+        """删除无流量的非最短路弧，加入能缩短最长路的捷径弧，保持无环"""
+        _, min_pred, _, _ = self._labels(link_time, epsilon)
+        link_to = self.assignment.link_to
+        for k in [k for k, value in self.flow.items() if value <= epsilon]:
+            if min_pred[link_to[k]] != k:
+                del self.flow[k]
+
+        # 对bush内所有弧都有 max_dist[i] < max_dist[j]，满足下式的新弧不会形成回路
+        _, _, _, max_dist = self._labels(link_time, epsilon)
+        link_from = self.assignment.link_from
+        added = False
+        for k in range(self.assignment.m):
+            i = link_from[k]
+            if k not in self.flow and max_dist[i] > -inf and max_dist[i] + link_time[k] < max_dist[link_to[k]]:
+                self.flow[k] = 0.0
+                added = True
+        return added
+
+    def shift_flows(self, link_time, link_derivative, apply, epsilon=1e-9):
+        """在各节点的最长已用路段与最短路段之间做牛顿法流量转移"""
+        order, min_pred, max_pred, _ = self._labels(link_time, epsilon)
+        link_from = self.assignment.link_from
+
+        for j in reversed(order):
+            if max_pred[j] == -1 or max_pred[j] == min_pred[j]:
+                continue
+
+            # 回溯最长已用路径，再沿最短路径回溯到与之相交的分叉节点
+            max_nodes = {j: 0}
+            max_links = []
+            i = j
+            while max_pred[i] != -1:
+                max_links.append(max_pred[i])
+                i = link_from[max_pred[i]]
+                max_nodes[i] = len(max_links)
+            if i != self.origin:
+                continue
+            min_links = []
+            i = j
+            while True:
+                k = min_pred[i]
+                min_links.append(k)
+                i = link_from[k]
+                if i in max_nodes:
+                    break
+            max_links = max_links[:max_nodes[i]]
+
+            difference = sum(link_time[k] for k in max_links) - sum(link_time[k] for k in min_links)
+            if difference <= 0:
+                continue
+            derivative = sum(link_derivative[k] for k in max_links) + sum(link_derivative[k] for k in min_links)
+            limit = min(self.flow[k] for k in max_links)
+            delta = min(difference / derivative, limit) if derivative > 0 else limit
+            if delta <= 0:
+                continue
+
+            for k in max_links:
+                self.flow[k] = max(self.flow[k] - delta, 0.0)
+                apply(k, -delta)
+            for k in min_links:
+                self.flow[k] += delta
+                apply(k, delta)
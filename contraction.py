@@ -0,0 +1,146 @@
+from collections import deque
+import numpy as np
+from datas import Network
+
+
+class ContractedNetwork:
+    """网络收缩预处理：删除不在任何OD对之间的节点和断头支路，合并度为2的串联路段，在缩减网络上求解后
+    再把流量展开回原始有向弧，用于结果输出和NetworkVisualization
+
+    串联路段只在其拥堵函数之和能由同一拥堵函数精确表示时合并（见各拥堵函数的series方法），
+    因此缩减网络上的均衡与原网络一致。
+    """
+
+    def __init__(self, network: Network):
+        self.network = network
+        link_from, link_to = network.link_from.tolist(), network.link_to.tolist()
+        terminals = set(network.demand_origin.tolist()) | set(network.demand_destination.tolist())
+
+        # 1. 只保留从某个起点可达、且可到达某个终点的节点
+        keep = self._reachable(network.demand_origin.tolist(), link_from, link_to, network.n) & \
+            self._reachable(network.demand_destination.tolist(), link_to, link_from, network.n)
+
+        # 缩减网络中的每条弧对应一串原始有向弧: 弧编号 -> (起点, 终点, [原始有向弧, ...])
+        # 邻接表 out_adj[i][j] / in_adj[j][i] 为i→j之间的弧编号列表（可能有平行弧）
+        self.chains = {}
+        out_adj = {i: {} for i in keep}
+        in_adj = {i: {} for i in keep}
+
+        def add(c, i, j, links):
+            self.chains[c] = (i, j, links)
+            out_adj[i].setdefault(j, []).append(c)
+            in_adj[j].setdefault(i, []).append(c)
+
+        def remove_node(v):
+            # 删除节点及其全部出入弧
+            for j, chains in out_adj.pop(v).items():
+                for c in chains:
+                    del self.chains[c]
+                del in_adj[j][v]
+            for i, chains in in_adj.pop(v).items():
+                for c in chains:
+                    del self.chains[c]
+                del out_adj[i][v]
+            keep.discard(v)
+
+        for k, (i, j) in enumerate(zip(link_from, link_to)):
+            if i in keep and j in keep:
+                add(k, i, j, [k])
+
+        # 2. 删除断头支路：非OD节点只有一个相邻节点时，经过它的路径只能原路返回
+        queue = deque(i for i in keep if i not in terminals)
+        while queue:
+            v = queue.popleft()
+            if v not in out_adj:
+                continue
+            neighbors = set(out_adj[v]) | set(in_adj[v])
+            if len(neighbors) <= 1:
+                remove_node(v)
+                queue.extend(u for u in neighbors if u not in terminals)
+
+        # 3. 合并串联路段：非OD节点恰有两个相邻节点u、w时，u→v→w 合并为 u→w
+        # 与v相连的平行弧之间按均衡条件分配流量，不能与串联路段合并，此时保留节点v
+        vdf, t0, capacity = network.vdf, network.free_flow_time.tolist(), network.link_capacity.tolist()
+        for v in [i for i in keep if i not in terminals]:
+            neighbors = set(out_adj[v]) | set(in_adj[v])
+            if len(neighbors) != 2 or any(len(chains) > 1 for adj in (out_adj[v], in_adj[v])
+                                          for chains in adj.values()):
+                continue
+            u, w = neighbors
+            merged = []
+            for a, b in ((u, w), (w, u)):
+                if a in in_adj[v] and b in out_adj[v]:
+                    if b in out_adj[a]:
+                        break # 已有a→b的弧，合并会产生平行弧
+                    links = self.chains[in_adj[v][a][0]][2] + self.chains[out_adj[v][b][0]][2]
+                    if vdf.series([t0[k] for k in links], [capacity[k] for k in links]) is None:
+                        break
+                    merged.append((a, b, links))
+            else:
+                # 只能掉头（u→v→u）的弧在简单路径上不会被使用，随节点一起删除
+                remove_node(v)
+                for a, b, links in merged:
+                    add(links[0], a, b, links)
+
+        self._build(sorted(keep))
+
+    @staticmethod
+    def _reachable(sources, link_from, link_to, n):
+        """沿弧方向从sources出发可到达的节点集合"""
+        out_links = [[] for _ in range(n)]
+        for i, j in zip(link_from, link_to):
+            out_links[i].append(j)
+        seen = set(sources)
+        queue = deque(seen)
+        while queue:
+            for j in out_links[queue.popleft()]:
+                if j not in seen:
+                    seen.add(j)
+                    queue.append(j)
+        return seen
+
+    def _build(self, nodes):
+        """由保留节点和合并后的弧构建缩减网络"""
+        network = self.network
+        node_index = {i: r for r, i in enumerate(nodes)}
+        vdf, t0, capacity = network.vdf, network.free_flow_time.tolist(), network.link_capacity.tolist()
+
+        link_from, link_to, free_flow_time, link_capacity, chains = [], [], [], [], []
+        for i, j, links in self.chains.values():
+            combined = vdf.series([t0[k] for k in links], [capacity[k] for k in links]) if len(links) > 1 \
+                else (t0[links[0]], capacity[links[0]])
+            link_from.append(node_index[i])
+            link_to.append(node_index[j])
+            free_flow_time.append(combined[0])
+            link_capacity.append(combined[1])
+            chains.append(links)
+
+        # 需求中起终点被删除（不连通）的OD对无法分配，直接舍弃
+        origin, destination = network.demand_origin.tolist(), network.demand_destination.tolist()
+        usable = [r for r, (i, j) in enumerate(zip(origin, destination)) if i in node_index and j in node_index]
+        demand = ([node_index[origin[r]] for r in usable], [node_index[destination[r]] for r in usable],
+                  network.demand_amount[usable])
+
+        names = network.get_names()
+        x, y = network.get_coordinates()
+        self.reduced = Network.from_links([names[i] for i in nodes], [x[i] for i in nodes], [y[i] for i in nodes],
+                                          link_from, link_to, free_flow_time, link_capacity, demand, network.vdf)
+
+        # 原始有向弧 -> 缩减网络有向弧（被删除的弧为-1）
+        position = np.empty(len(chains), dtype=np.int64)
+        position[self.reduced.link_edge] = np.arange(len(chains))
+        self.link_map = np.full(network.m, -1, dtype=np.int64)
+        for p, links in enumerate(chains):
+            self.link_map[links] = position[p]
+        self.node_map = np.full(network.n, -1, dtype=np.int64)
+        self.node_map[nodes] = np.arange(len(nodes))
+
+    def expand_flow(self, link_flow):
+        """将缩减网络的路段流量展开为原始网络各有向弧的流量"""
+        link_flow = np.asarray(link_flow, dtype=float)
+        return np.where(self.link_map >= 0, link_flow[np.maximum(self.link_map, 0)], 0.0)
+
+    def summary(self):
+        """收缩前后的节点数和有向弧数"""
+        return {'nodes': self.network.n, 'links': self.network.m,
+                'reduced_nodes': self.reduced.n, 'reduced_links': self.reduced.m}
@@ -1,9 +1,71 @@
+import csv
+import hashlib
 import json
-from math import inf, sqrt
+import os
+from itertools import islice
+from math import sqrt
+import numpy as np
+from delay_functions import QuadraticDelay
+
+
+# 编译缓存格式版本，缓存内容变化时递增以使旧缓存失效
+COMPILED_VERSION = 1
 
 
 class Network:
-    def __init__(self, network_file:str, demand_file:str): # 文件名
+    def __init__(self, network_file:str, demand_file:str, vdf=None, cache_dir=None): # 文件名, 拥堵函数, 编译缓存目录
+        self.vdf = vdf if vdf is not None else QuadraticDelay()
+        self._link_index = None
+
+        # 有缓存目录时优先读取与源文件哈希匹配的编译结果
+        compiled_file = _compiled_path(network_file, demand_file, cache_dir) if cache_dir else None
+        if compiled_file and os.path.exists(compiled_file):
+            self._load_compiled(compiled_file)
+            return
+
+        self._build(network_file, demand_file)
+        if compiled_file:
+            self._save_compiled(compiled_file)
+
+    @classmethod
+    def from_links(cls, names, x, y, link_from, link_to, free_flow_time, capacity, demand, vdf=None):
+        """由有向弧数组直接构建网络（TNTP等外部数据或合成网络），每条有向弧作为一条路段
+
+        demand: (起点编号数组, 终点编号数组, 需求量数组)
+        """
+        network = cls.__new__(cls)
+        network.vdf = vdf if vdf is not None else QuadraticDelay()
+        network._link_index = None
+        network.names = list(names)
+        network.x = list(x)
+        network.y = list(y)
+        network.n = len(network.names)
+        network.name_index = {name: i for i, name in enumerate(network.names)}
+        network.demand_origin = np.asarray(demand[0], dtype=np.int32)
+        network.demand_destination = np.asarray(demand[1], dtype=np.int32)
+        network.demand_amount = np.asarray(demand[2], dtype=float)
+
+        link_from = np.asarray(link_from, dtype=np.int32)
+        link_to = np.asarray(link_to, dtype=np.int32)
+        network.edge_nodes = np.stack([link_from, link_to], axis=1)
+        network.between = [(network.names[i], network.names[j]) for i, j in network.edge_nodes.tolist()]
+        network.capacity = np.asarray(capacity, dtype=float).tolist()
+        network.speed_max = [0.0] * len(network.between) # 外部数据直接给出自由流时间，不使用限速
+
+        # 按起点排序，构成前向星（CSR）结构
+        order = np.lexsort((link_to, link_from))
+        network.m = len(order)
+        network.link_from = link_from[order]
+        network.link_to = link_to[order]
+        network.free_flow_time = np.asarray(free_flow_time, dtype=float)[order]
+        network.link_capacity = np.asarray(capacity, dtype=float)[order]
+        network.link_edge = order.astype(np.int32)
+        network.first_out = np.zeros(network.n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(network.link_from, minlength=network.n), out=network.first_out[1:])
+        return network
+
+    def _build(self, network_file, demand_file):
+        """解析JSON网络和需求文件，构建有向弧表"""
         with open(network_file, 'r', encoding='utf-8') as f:
             network = json.load(f)
             nodes = network['nodes']
@@ -16,80 +78,257 @@ class Network:
         self.capacity = links['capacity'] # 相邻节点通行能力
         self.speed_max = links['speedmax'] # 相邻节点限速
         self.n = len(self.names)
+        self.name_index = {name: i for i, name in enumerate(self.names)} # 节点名 -> 编号
 
-        # 读取需求数据
-        with open(demand_file, 'r', encoding='utf-8') as f:
-            demand = json.load(f)
-        
-        self.demand_from = demand['from']
-        self.demand_to = demand['to']
-        self.demand_amount = demand['amount']
-        
-        # 初始化各种矩阵
-        self.time_link = [[inf] * self.n for _ in range(self.n)] # 相邻节点最短时间
-        self.capacity_matrix = [[0] * self.n for _ in range(self.n)] # 通行能力矩阵
-        self.adjacency = [[False] * self.n for _ in range(self.n)] # 邻接矩阵
-        
-        # 初始化各种矩阵
+        # 读取需求数据（起点编号, 终点编号, 需求量），按文件中的顺序保存
+        self.demand_origin, self.demand_destination, self.demand_amount = read_demand(demand_file, self.name_index)
+
+        # 每条路段拆成两条有向弧
+        arcs = []
+        edge_nodes = [] # 路段两端节点编号
         for z, (c1, c2) in enumerate(self.between):
-            i = self.names.index(c1)
-            j = self.names.index(c2)
+            i = self.name_index[c1]
+            j = self.name_index[c2]
             x1, y1 = self.x[i], self.y[i]
             x2, y2 = self.x[j], self.y[j]
             distance = sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
-            
+
             # 计算自由流行程时间（分钟）
             free_flow_time = 60 * distance / self.speed_max[z]
-            self.time_link[i][j] = self.time_link[j][i] = free_flow_time
-            self.capacity_matrix[i][j] = self.capacity_matrix[j][i] = self.capacity[z]
-            self.adjacency[i][j] = self.adjacency[j][i] = True
+            arcs.append((i, j, free_flow_time, self.capacity[z], z))
+            arcs.append((j, i, free_flow_time, self.capacity[z], z))
+            edge_nodes.append((i, j))
+        self.edge_nodes = np.array(edge_nodes, dtype=np.int32).reshape(-1, 2)
+
+        # 按起点排序，构成前向星（CSR）结构，有向弧编号即排序后的位置
+        arcs.sort(key=lambda arc: (arc[0], arc[1]))
+        self.m = len(arcs)
+        self.link_from = np.array([arc[0] for arc in arcs], dtype=np.int32) # 有向弧起点
+        self.link_to = np.array([arc[1] for arc in arcs], dtype=np.int32) # 有向弧终点
+        self.free_flow_time = np.array([arc[2] for arc in arcs], dtype=float) # 自由流行程时间
+        self.link_capacity = np.array([arc[3] for arc in arcs], dtype=float) # 通行能力
+        self.link_edge = np.array([arc[4] for arc in arcs], dtype=np.int32) # 所属路段编号
 
-    def get_time_link(self) -> list:
-        """获取相邻节点自由流行程时间矩阵"""
-        return self.time_link
+        # first_out[i]:first_out[i + 1] 为节点i的出弧编号范围
+        self.first_out = np.zeros(self.n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.link_from, minlength=self.n), out=self.first_out[1:])
+
+    def _save_compiled(self, compiled_file):
+        """将解析结果保存为.npz编译缓存，并删除同一源文件的旧缓存"""
+        directory, filename = os.path.split(compiled_file)
+        os.makedirs(directory, exist_ok=True)
+        prefix = filename.rsplit('-', 1)[0] + '-'
+        for old in os.listdir(directory):
+            if old.startswith(prefix) and old != filename:
+                os.remove(os.path.join(directory, old))
+
+        temporary = compiled_file + '.tmp.npz'
+        np.savez(temporary, names=np.array(self.names, dtype=str), x=np.array(self.x, dtype=float),
+                 y=np.array(self.y, dtype=float), edge_nodes=self.edge_nodes,
+                 capacity=np.array(self.capacity, dtype=float), speed_max=np.array(self.speed_max, dtype=float),
+                 link_from=self.link_from, link_to=self.link_to, free_flow_time=self.free_flow_time,
+                 link_capacity=self.link_capacity, link_edge=self.link_edge, first_out=self.first_out,
+                 demand_origin=self.demand_origin, demand_destination=self.demand_destination,
+                 demand_amount=self.demand_amount)
+        os.replace(temporary, compiled_file)
+
+    def _load_compiled(self, compiled_file):
+        """从.npz编译缓存恢复网络和需求"""
+        with np.load(compiled_file) as data:
+            self.names = data['names'].tolist()
+            self.x = data['x'].tolist()
+            self.y = data['y'].tolist()
+            self.edge_nodes = data['edge_nodes']
+            self.capacity = data['capacity'].tolist()
+            self.speed_max = data['speed_max'].tolist()
+            for key in ('link_from', 'link_to', 'free_flow_time', 'link_capacity', 'link_edge', 'first_out',
+                        'demand_origin', 'demand_destination', 'demand_amount'):
+                setattr(self, key, data[key])
+        self.n = len(self.names)
+        self.m = len(self.link_from)
+        self.name_index = {name: i for i, name in enumerate(self.names)}
+        self.between = [(self.names[i], self.names[j]) for i, j in self.edge_nodes.tolist()]
+
+    def get_time_link(self) -> np.ndarray:
+        """获取各有向弧自由流行程时间"""
+        return self.free_flow_time
 
     def get_names(self):
         """获取节点名称列表"""
         return self.names
-    
+
     def get_coordinates(self):
         """获取节点坐标"""
         return self.x, self.y
-    
-    def get_capacity_matrix(self):
-        """获取通行能力矩阵"""
-        return self.capacity_matrix
-    
-    def get_adjacency_matrix(self):
-        """获取邻接矩阵"""
-        return self.adjacency
-    
+
+    def get_capacity(self):
+        """获取各有向弧通行能力"""
+        return self.link_capacity
+
+    def get_links(self):
+        """获取各有向弧的起点和终点"""
+        return self.link_from, self.link_to
+
+    def get_forward_star(self):
+        """获取前向星结构（出弧起始位置, 弧终点）"""
+        return self.first_out, self.link_to
+
+    def get_link_index(self, from_node, to_node):
+        """获取两相邻节点间有向弧编号，不相邻时返回None"""
+        if self._link_index is None:
+            # (起点, 终点) -> 有向弧编号，首次使用时构建
+            self._link_index = {(i, j): k for k, (i, j) in enumerate(zip(self.link_from.tolist(), self.link_to.tolist()))}
+        return self._link_index.get((from_node, to_node))
+
+    def get_edge_nodes(self):
+        """获取各路段两端节点编号"""
+        return self.edge_nodes
+
+    def zero_flow(self):
+        """生成全零的路段流量向量"""
+        return np.zeros(self.m)
+
+    def get_edge_flow(self, link_flow):
+        """将有向弧流量汇总为路段（双向之和）流量"""
+        return np.bincount(self.link_edge, weights=link_flow, minlength=len(self.between))
+
+    def get_node_index(self, name):
+        """获取节点名称对应的编号"""
+        return self.name_index[name]
+
     def get_demand_data(self):
         """获取需求数据"""
-        od_pairs = []
-        for i in range(len(self.demand_from)):
-            from_idx = self.names.index(self.demand_from[i])
-            to_idx = self.names.index(self.demand_to[i])
-            od_pairs.append((from_idx, to_idx, self.demand_amount[i]))
-        return od_pairs
-    
-    def calculate_congested_time(self, flow_matrix):
+        return list(zip(self.demand_origin.tolist(), self.demand_destination.tolist(), self.demand_amount.tolist()))
+
+    def get_origin_demand(self):
+        """获取按起点分组的需求 {起点: (终点编号数组, 需求量数组)}，数组为排序后紧凑数组的视图"""
+        order = np.argsort(self.demand_origin, kind='stable')
+        origin = self.demand_origin[order]
+        destination = self.demand_destination[order]
+        amount = self.demand_amount[order].astype(float)
+        starts = np.flatnonzero(np.r_[True, origin[1:] != origin[:-1]]) if len(origin) else []
+        ends = list(starts[1:]) + [len(origin)]
+        return {int(origin[a]): (destination[a:b], amount[a:b]) for a, b in zip(starts, ends)}
+
+    def evaluate_costs(self, link_flow):
+        """批量计算路段行程时间、导数、Beckmann目标函数值和路网总出行时间"""
+        flow = np.asarray(link_flow, dtype=float)
+        time = self.calculate_congested_time(flow)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # 通行能力为0的路段不可通行
+            derivative = np.where(self.link_capacity > 0,
+                                  self.vdf.derivative(self.free_flow_time, self.link_capacity, flow), np.inf)
+            objective = np.where(flow > 0, self.vdf.integral(self.free_flow_time, self.link_capacity, flow), 0.0).sum()
+            total_time = np.where(flow > 0, time * flow, 0.0).sum()
+        return time, derivative, objective, total_time
+
+    def calculate_congested_time(self, link_flow):
         """根据流量计算拥堵时间"""
-        congested_time = [[inf] * self.n for _ in range(self.n)]
-        for i in range(self.n):
-            for j in range(self.n):
-                if self.adjacency[i][j] and self.capacity_matrix[i][j] > 0:
-                    # 拥堵函数: t(q) = t0 * (1 + q/cap)^2
-                    ratio = flow_matrix[i][j] / self.capacity_matrix[i][j]
-                    congested_time[i][j] = self.time_link[i][j] * (1 + ratio) ** 2
-        return congested_time
-    
-    def calculate_total_travel_time(self, flow_matrix):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            time = self.vdf.time(self.free_flow_time, self.link_capacity, np.asarray(link_flow, dtype=float))
+        return np.where(self.link_capacity > 0, time, np.inf)
+
+    def calculate_beckmann_objective(self, link_flow):
+        """计算Beckmann目标函数值（各路段行程时间积分之和）"""
+        return self.evaluate_costs(link_flow)[2]
+
+    def calculate_total_travel_time(self, link_flow):
         """计算路网总出行时间"""
-        total_time = 0
-        for i in range(self.n):
-            for j in range(self.n):
-                if self.adjacency[i][j] and flow_matrix[i][j] > 0:
-                    congested_time = self.time_link[i][j] * (1 + flow_matrix[i][j] / self.capacity_matrix[i][j]) ** 2
-                    total_time += congested_time * flow_matrix[i][j]
-        return total_time
\ No newline at end of file
+        return self.evaluate_costs(link_flow)[3]
+
+
+def read_demand(demand_file, name_index, chunk_size=100000):
+    """按文件扩展名读取需求数据，返回(起点编号数组, 终点编号数组, 需求量数组)
+
+    .json: {"from": [...], "to": [...], "amount": [...]}
+    .csv:  表头为 from,to,amount 的逐行OD表，分块流式读取
+    .npy:  n×n 稠密OD矩阵，以内存映射方式分块读取
+    .npz:  CSR格式稀疏OD矩阵（indptr, indices, data）
+    """
+    extension = os.path.splitext(demand_file)[1].lower()
+    if extension == '.csv':
+        return _read_demand_csv(demand_file, name_index, chunk_size)
+    if extension == '.npy':
+        return _read_demand_dense(demand_file, len(name_index), chunk_size)
+    if extension == '.npz':
+        return _read_demand_sparse(demand_file, len(name_index))
+
+    with open(demand_file, 'r', encoding='utf-8') as f:
+        demand = json.load(f)
+    origin = np.array([name_index[name] for name in demand['from']], dtype=np.int32)
+    destination = np.array([name_index[name] for name in demand['to']], dtype=np.int32)
+    return origin, destination, np.array(demand['amount'])
+
+
+def _read_demand_csv(demand_file, name_index, chunk_size):
+    """分块流式读取CSV需求表，每块转换为紧凑数组后再合并"""
+    origins, destinations, amounts = [], [], []
+    with open(demand_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = [column.strip() for column in next(reader)]
+        columns = [header.index(column) for column in ('from', 'to', 'amount')]
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                break
+            origins.append(np.array([name_index[row[columns[0]]] for row in rows], dtype=np.int32))
+            destinations.append(np.array([name_index[row[columns[1]]] for row in rows], dtype=np.int32))
+            amounts.append(np.array([row[columns[2]] for row in rows], dtype=float))
+    if not origins:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0)
+    return np.concatenate(origins), np.concatenate(destinations), np.concatenate(amounts)
+
+
+def _read_demand_dense(demand_file, n, chunk_size):
+    """以内存映射方式按行块读取稠密OD矩阵，只保留非零元素"""
+    matrix = np.load(demand_file, mmap_mode='r')
+    if matrix.shape != (n, n):
+        raise ValueError(f"OD矩阵维度 {matrix.shape} 与节点数 {n} 不符")
+    rows_per_block = max(chunk_size // max(n, 1), 1)
+    origins, destinations, amounts = [], [], []
+    for start in range(0, n, rows_per_block):
+        block = np.asarray(matrix[start:start + rows_per_block])
+        row, column = np.nonzero(block)
+        origins.append((row + start).astype(np.int32))
+        destinations.append(column.astype(np.int32))
+        amounts.append(block[row, column].astype(float))
+    return np.concatenate(origins), np.concatenate(destinations), np.concatenate(amounts)
+
+
+def _read_demand_sparse(demand_file, n):
+    """读取CSR格式的稀疏OD矩阵"""
+    with np.load(demand_file) as data:
+        indptr, indices, amount = data['indptr'], data['indices'], data['data']
+    if len(indptr) != n + 1:
+        raise ValueError(f"OD矩阵行数 {len(indptr) - 1} 与节点数 {n} 不符")
+    origin = np.repeat(np.arange(n, dtype=np.int32), np.diff(indptr))
+    keep = amount != 0
+    return origin[keep], indices[keep].astype(np.int32), amount[keep].astype(float)
+
+
+def save_demand_matrix(demand_file, n, origin, destination, amount, dense=False):
+    """将需求保存为二进制OD矩阵：dense=True 时为 n×n 的.npy，否则为CSR格式的.npz"""
+    origin = np.asarray(origin, dtype=np.int64)
+    destination = np.asarray(destination, dtype=np.int64)
+    amount = np.asarray(amount, dtype=float)
+    if dense:
+        matrix = np.lib.format.open_memmap(demand_file, mode='w+', dtype=float, shape=(n, n))
+        np.add.at(matrix, (origin, destination), amount)
+        matrix.flush()
+        return
+
+    order = np.lexsort((destination, origin))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(origin, minlength=n), out=indptr[1:])
+    np.savez(demand_file, indptr=indptr, indices=destination[order].astype(np.int32), data=amount[order])
+
+
+def _compiled_path(network_file, demand_file, cache_dir):
+    """根据源文件内容哈希生成编译缓存文件路径，源文件改变后自动对应新的缓存"""
+    digest = hashlib.sha256(str(COMPILED_VERSION).encode())
+    for path in (network_file, demand_file):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    stem = '_'.join(os.path.splitext(os.path.basename(path))[0] for path in (network_file, demand_file))
+    return os.path.join(cache_dir, f"{stem}-{digest.hexdigest()[:16]}.npz")
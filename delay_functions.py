@@ -0,0 +1,100 @@
+import numpy as np
+
+
+def _series_same_capacity(t0, capacity):
+    """t = t0 * g(q/cap) 形式的函数：通行能力相同的串联路段可精确合并为自由流时间之和，否则返回None"""
+    if min(capacity) <= 0 or max(capacity) != min(capacity):
+        return None
+    return sum(t0), capacity[0]
+
+
+class QuadraticDelay:
+    """二次拥堵函数: t(q) = t0 * (1 + q/cap)^2"""
+
+    def time(self, t0, capacity, flow):
+        """路段行程时间"""
+        return t0 * (1 + flow / capacity) ** 2
+
+    def derivative(self, t0, capacity, flow):
+        """行程时间对流量的导数"""
+        return 2 * t0 * (1 + flow / capacity) / capacity
+
+    def integral(self, t0, capacity, flow):
+        """行程时间从0到q的积分（Beckmann目标函数项）"""
+        return t0 * capacity / 3 * ((1 + flow / capacity) ** 3 - 1)
+
+    def series(self, t0, capacity):
+        """串联路段（流量相同）合并为一条等效路段的(自由流时间, 通行能力)，无法精确合并时返回None"""
+        return _series_same_capacity(t0, capacity)
+
+
+class BPRDelay:
+    """BPR函数: t(q) = t0 * (1 + alpha * (q/cap)^beta)"""
+
+    def __init__(self, alpha=0.15, beta=4.0):
+        self.alpha = alpha
+        self.beta = beta
+
+    def time(self, t0, capacity, flow):
+        """路段行程时间"""
+        return t0 * (1 + self.alpha * (flow / capacity) ** self.beta)
+
+    def derivative(self, t0, capacity, flow):
+        """行程时间对流量的导数"""
+        return t0 * self.alpha * self.beta * (flow / capacity) ** (self.beta - 1) / capacity
+
+    def integral(self, t0, capacity, flow):
+        """行程时间从0到q的积分（Beckmann目标函数项）"""
+        ratio = flow / capacity
+        return t0 * (flow + self.alpha * capacity * ratio ** (self.beta + 1) / (self.beta + 1))
+
+    def series(self, t0, capacity):
+        """串联路段（流量相同）合并为一条等效路段的(自由流时间, 通行能力)，无法精确合并时返回None
+
+        sum(t0_i * (1 + alpha * (q/c_i)^beta)) = T0 * (1 + alpha * (q/C)^beta)，T0 = sum(t0_i)，C^beta = T0 / sum(t0_i / c_i^beta)
+        """
+        if min(capacity) <= 0:
+            return None
+        total = sum(t0)
+        weight = sum(t / c ** self.beta for t, c in zip(t0, capacity))
+        if total <= 0 or weight <= 0:
+            return _series_same_capacity(t0, capacity)
+        return total, (total / weight) ** (1 / self.beta)
+
+
+class ConicalDelay:
+    """Spiess锥形函数: t(q) = t0 * (2 + sqrt(a^2(1-x)^2 + b^2) - a(1-x) - b), x = q/cap, b = (2a-1)/(2a-2)"""
+
+    def __init__(self, alpha=4.0):
+        self.alpha = alpha
+        self.beta = (2 * alpha - 1) / (2 * alpha - 2)
+
+    def time(self, t0, capacity, flow):
+        """路段行程时间"""
+        a, b = self.alpha, self.beta
+        rest = 1 - flow / capacity
+        return t0 * (2 + np.sqrt(a ** 2 * rest ** 2 + b ** 2) - a * rest - b)
+
+    def derivative(self, t0, capacity, flow):
+        """行程时间对流量的导数"""
+        a, b = self.alpha, self.beta
+        rest = 1 - flow / capacity
+        return t0 / capacity * (a - a ** 2 * rest / np.sqrt(a ** 2 * rest ** 2 + b ** 2))
+
+    def integral(self, t0, capacity, flow):
+        """行程时间从0到q的积分（Beckmann目标函数项）"""
+        a, b = self.alpha, self.beta
+        ratio = flow / capacity
+
+        def antiderivative(w):
+            # sqrt(w^2 + b^2) 的原函数
+            root = np.sqrt(w ** 2 + b ** 2)
+            return (w * root + b ** 2 * np.log(w + root)) / 2
+
+        area = ((2 - b) * ratio - a * (ratio - ratio ** 2 / 2)
+                + (antiderivative(a) - antiderivative(a * (1 - ratio))) / a)
+        return t0 * capacity * area
+
+    def series(self, t0, capacity):
+        """串联路段（流量相同）合并为一条等效路段的(自由流时间, 通行能力)，无法精确合并时返回None"""
+        return _series_same_capacity(t0, capacity)
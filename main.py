@@ -1,6 +1,6 @@
 from datas import Network
 from algorithms import TrafficAssignment
-from visualization import NetworkVisualization
+from paths import PathStore
 import os
 
 
@@ -9,9 +9,8 @@ def main():
     print("=== 交通分配计算软件 ===\n")
     
     # 初始化网络
-    network = Network('network.json', 'demand.json')
+    network = Network('network.json', 'demand.json', cache_dir='.cache')
     assignment = TrafficAssignment(network)
-    visualization = NetworkVisualization(network)
     
     # 创建输出目录
     if not os.path.exists('output'):
@@ -22,18 +21,16 @@ def main():
     
     # 计算自由流状态下的最短路径
     time_link = network.get_time_link()
-    _, path_matrix = assignment.floyd_warshall(time_link)
     
     names = network.get_names()
     for i in range(len(names)):
+        tree = assignment.shortest_path_tree(time_link, i)
         for j in range(len(names)):
             if i != j:
-                path = assignment.get_path_from_path_matrix(path_matrix, i, j)
+                path = assignment.get_path_from_tree(tree, j)
                 if path:
                     path_names = [names[node] for node in path]
-                    path_time = 0
-                    for k in range(len(path) - 1):
-                        path_time += time_link[path[k]][path[k + 1]]
+                    path_time = sum(time_link[k] for k in assignment.get_tree_links(tree, j))
                     print(f"{names[i]} → {names[j]}: {' → '.join(path_names)}, 时间: {path_time:.1f} 分钟")
     
     print("\n2. 交通分配算法比较")
@@ -51,38 +48,35 @@ def main():
     
     # Frank-Wolfe算法
     print("\n正在执行Frank-Wolfe算法...")
-    frank_wolfe_flow = assignment.frank_wolfe_assignment(max_iterations=10)
+    path_store = PathStore(assignment)
+    frank_wolfe_flow = assignment.frank_wolfe_assignment(max_iterations=100, target_gap=1e-4, path_store=path_store)
     assignment.print_assignment_results(frank_wolfe_flow, "Frank-Wolfe")
     
     print("\n3. 单个OD对分析 (A → F)")
     print("=" * 50)
     
     # 获取A到F的索引
-    a_idx = names.index('A')
-    f_idx = names.index('F')
+    a_idx = network.get_node_index('A')
+    f_idx = network.get_node_index('F')
     
     # 分析A到F的路径
-    for algorithm_name, flow_matrix in [("全有全无", all_or_nothing_flow), 
-                                       ("增量分配", incremental_flow), 
-                                       ("Frank-Wolfe", frank_wolfe_flow)]:
+    for algorithm_name, link_flow in [("全有全无", all_or_nothing_flow), 
+                                     ("增量分配", incremental_flow), 
+                                     ("Frank-Wolfe", frank_wolfe_flow)]:
         print(f"\n{algorithm_name}算法下A→F的分配:")
         
         # 计算拥堵时间
-        congested_time = network.calculate_congested_time(flow_matrix)
-        _, path_matrix = assignment.floyd_warshall(congested_time)
+        congested_time = network.calculate_congested_time(link_flow)
+        tree = assignment.shortest_path_tree(congested_time, a_idx)
         
         # 获取A到F的最短路径
-        path = assignment.get_path_from_path_matrix(path_matrix, a_idx, f_idx)
+        path = assignment.get_path_from_tree(tree, f_idx)
         path_names = [names[node] for node in path]
         
         # 计算路径时间和流量
-        path_time = 0
-        path_flows = []
-        for k in range(len(path) - 1):
-            from_node = path[k]
-            to_node = path[k + 1]
-            path_time += congested_time[from_node][to_node]
-            path_flows.append(flow_matrix[from_node][to_node])
+        path_links = assignment.get_tree_links(tree, f_idx)
+        path_time = sum(congested_time[k] for k in path_links)
+        path_flows = [link_flow[k] for k in path_links]
         
         print(f"路径: {' → '.join(path_names)}")
         print(f"总时间: {path_time:.1f} 分钟")
@@ -90,9 +84,27 @@ def main():
         for k in range(len(path) - 1):
             print(f"  {names[path[k]]} → {names[path[k+1]]}: {path_flows[k]:.1f} 辆/小时")
     
+    # 均衡状态下的路径流量：直接查询Frank-Wolfe求解时记录的路径，不需要重新计算
+    print("\nFrank-Wolfe均衡下A→F的路径流量:")
+    for links, flow in path_store.od_paths(a_idx, f_idx):
+        path_names = [names[assignment.link_from[links[0]]]] + [names[assignment.link_to[k]] for k in links]
+        print(f"  {' → '.join(path_names)}: {flow:.1f} 辆/小时")
+
+    b_idx, e_idx = network.get_node_index('B'), network.get_node_index('E')
+    print("\n选定路段B→E上的OD构成（Frank-Wolfe）:")
+    for origin, destination, flow in path_store.select_link(network.get_link_index(b_idx, e_idx)):
+        print(f"  {names[origin]} → {names[destination]}: {flow:.1f} 辆/小时")
+
+    cache_info = assignment.tree_cache_info()
+    print(f"\n最短路径树缓存: 命中 {cache_info['hits']} 次, 计算 {cache_info['misses']} 次")
+    
     print("\n4. 可视化结果")
     print("=" * 50)
     
+    # 仅在需要绘图时导入可视化模块（matplotlib）
+    from visualization import NetworkVisualization
+    visualization = NetworkVisualization(network)
+    
     # 生成各种算法的可视化结果
     algorithms = [
         (all_or_nothing_flow, "全有全无分配"),
@@ -100,16 +112,14 @@ def main():
         (frank_wolfe_flow, "Frank-Wolfe算法")
     ]
     
-    # 单独保存每种算法的结果
-    for flow_matrix, algorithm_name in algorithms:
-        fig, ax = visualization.plot_network(flow_matrix, algorithm_name)
-        filename = f"output/{algorithm_name.replace(' ', '_')}.png"
-        visualization.save_plot(fig, filename)
+    # 单独保存每种算法的结果（多核时并行绘制）
+    visualization.save_plots([flow for flow, _ in algorithms], [name for _, name in algorithms],
+                             [f"output/{name.replace(' ', '_')}.png" for _, name in algorithms])
     
     # 比较图
-    flow_matrices = [flow for flow, _ in algorithms]
+    link_flows = [flow for flow, _ in algorithms]
     algorithm_names = [name for _, name in algorithms]
-    fig, axes = visualization.compare_algorithms(flow_matrices, algorithm_names)
+    fig, axes = visualization.compare_algorithms(link_flows, algorithm_names)
     visualization.save_plot(fig, "output/算法比较.png")
     
     print("\n所有结果已保存到 output/ 目录")
@@ -0,0 +1,89 @@
+import os
+from multiprocessing import Pool, shared_memory
+import numpy as np
+from shortest_path import dijkstra, load_tree
+
+# 工作进程内的全局状态，由_init_worker初始化
+_worker = {}
+
+
+def _attach(name, dtype, shape):
+    """在工作进程中挂载共享内存数组（由主进程负责释放）"""
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(spec, chunks):
+    """工作进程初始化：挂载共享数组，缓存网络拓扑和分到的起点需求"""
+    handles = {key: _attach(*value) for key, value in spec.items()}
+    _worker['handles'] = handles
+    _worker['first_out'] = handles['first_out'][1].tolist()
+    _worker['link_to'] = handles['link_to'][1].tolist()
+    _worker['link_from'] = handles['link_from'][1].tolist()
+    _worker['link_time'] = handles['link_time'][1]
+    _worker['result'] = handles['result'][1]
+    _worker['chunks'] = chunks
+
+
+def _load_chunk(task):
+    """对一组起点执行全有全无加载，结果写入共享结果矩阵的对应行"""
+    index, scale = task
+    first_out, link_to, link_from = _worker['first_out'], _worker['link_to'], _worker['link_from']
+    link_time = _worker['link_time'].tolist()
+    link_flow = [0.0] * len(link_to)
+    for origin, demand in _worker['chunks'][index]:
+        tree = dijkstra(first_out, link_to, link_time, origin)
+        load_tree(link_from, tree, demand, link_flow, scale)
+    _worker['result'][index, :] = link_flow
+    return index
+
+
+class ParallelLoader:
+    """多进程全有全无加载：起点划分到各进程，路段时间经共享内存只读共享，各进程的部分流量在主进程汇总"""
+
+    def __init__(self, assignment, workers=None):
+        self.workers = workers or os.cpu_count()
+        network = assignment.network
+        self._blocks = []
+
+        # 按需求量轮流分配起点，使各组工作量大致均衡
+        origins = sorted(assignment.origin_demand.items(), key=lambda item: -len(item[1][0]))
+        count = min(self.workers, max(len(origins), 1))
+        self.chunks = [origins[c::count] for c in range(count)]
+
+        spec = {}
+        first_out, link_to = network.get_forward_star()
+        link_from, _ = network.get_links()
+        for key, array in [('first_out', np.asarray(first_out, dtype=np.int64)),
+                           ('link_to', np.asarray(link_to, dtype=np.int64)),
+                           ('link_from', np.asarray(link_from, dtype=np.int64)),
+                           ('link_time', np.zeros(network.m)),
+                           ('result', np.zeros((count, network.m)))]:
+            spec[key] = self._share(key, array)
+        self.pool = Pool(self.workers, initializer=_init_worker, initargs=(spec, self.chunks))
+
+    def _share(self, key, array):
+        """将数组复制到新建的共享内存块，返回挂载参数"""
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        shared[...] = array
+        self._blocks.append(shm)
+        setattr(self, key, shared)
+        return shm.name, array.dtype.str, array.shape
+
+    def load(self, link_time, scale=1.0):
+        """在给定路段时间下并行执行一次全有全无加载，返回路段流量"""
+        self.link_time[:] = link_time
+        self.pool.map(_load_chunk, [(index, scale) for index in range(len(self.chunks))])
+        return self.result.sum(axis=0)
+
+    def close(self):
+        """关闭进程池并释放共享内存"""
+        self.pool.close()
+        self.pool.join()
+        for key in ('first_out', 'link_to', 'link_from', 'link_time', 'result'):
+            delattr(self, key)
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
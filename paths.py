@@ -0,0 +1,178 @@
+import warnings
+
+
+class PathStore:
+    """哈希共享（hash-consing）的路径存储，供选定路段分析和OD路径报告使用
+
+    每条路径表示为(前缀路径编号, 末弧)单元，相同的有向弧序列只保存一份，共同前缀在各路径间共享。
+    求解器记录各OD对使用的路径及其流量 {(起点, 终点): {路径编号: 流量}}，求解后按索引查询，无需重新求解。
+    soft_limit为路径单元数的软上限：超过时先回收不再使用的单元，仍超出时将流量最小的路径并入同一OD对流量最大的路径，
+    被合并的流量累计在overflow中。每个OD对至少保留一条路径，因此OD对很多时单元数可能无法降到上限以下，此时发出警告。
+    """
+
+    def __init__(self, assignment, soft_limit=100000):
+        self.link_from = assignment.link_from
+        self.link_to = assignment.link_to
+        self.soft_limit = soft_limit
+        self._warned = False
+        self.cells = [] # 路径编号 -> (前缀路径编号, 末弧)，空路径的前缀为-1；已回收的编号为None
+        self._index = {} # (前缀路径编号, 末弧) -> 路径编号
+        self._free = [] # 可复用的路径编号
+        self.od_flow = {}
+        self.overflow = 0.0
+        self._link_paths = None # 有向弧 -> 经过该弧的已用路径编号，查询时按需构建
+
+    def __len__(self):
+        return len(self.cells) - len(self._free)
+
+    def intern(self, prefix, link):
+        """返回前缀路径加上末弧得到的路径编号，相同路径只保存一份"""
+        key = (prefix, link)
+        path = self._index.get(key)
+        if path is None:
+            if self._free:
+                path = self._free.pop()
+                self.cells[path] = key
+            else:
+                path = len(self.cells)
+                self.cells.append(key)
+            self._index[key] = path
+        return path
+
+    def tree_flows(self, origin, tree, demand, scale, out):
+        """将一个起点的需求按最短路径树记入路径流量 out[(起点, 终点)] = {路径编号: 流量}"""
+        _, pred, _ = tree
+        node_path = {origin: -1}
+        destinations, amounts = demand
+        for destination, amount in zip(destinations.tolist(), amounts.tolist()):
+            if destination == origin or pred[destination] == -1:
+                continue
+            # 向上回溯到已知路径的节点，再沿途依次生成各节点的路径
+            chain = []
+            i = destination
+            while i not in node_path:
+                chain.append(pred[i])
+                i = self.link_from[pred[i]]
+            path = node_path[i]
+            for k in reversed(chain):
+                path = self.intern(path, k)
+                node_path[self.link_to[k]] = path
+            flows = out.setdefault((origin, destination), {})
+            flows[path] = flows.get(path, 0.0) + amount * scale
+
+    def links(self, path):
+        """路径编号对应的有向弧序列"""
+        links = []
+        while path != -1:
+            path, k = self.cells[path]
+            links.append(k)
+        links.reverse()
+        return links
+
+    def maintain(self, flow_sets):
+        """路径单元数超过软上限时回收不再被flow_sets引用的单元，仍超出时合并flow_sets[0]中流量最小的路径"""
+        if len(self) <= self.soft_limit:
+            return
+        self.collect(flow_sets)
+        if len(self) <= self.soft_limit:
+            return
+
+        # 各OD对保留流量最大的路径，其余路径按流量从大到小保留，直到路径单元数达到上限的一半，剩余路径被合并
+        current = flow_sets[0]
+        largest = {od: max(flows, key=flows.get) for od, flows in current.items() if flows}
+        others = sorted(((flow, od, path) for od, flows in current.items() for path, flow in flows.items()
+                         if path != largest[od]), key=lambda item: -item[0])
+        live = set()
+        doomed = {}
+        ranked = [(od, path) for od, path in largest.items()] + [(od, path) for _, od, path in others]
+        for rank, (od, path) in enumerate(ranked):
+            cells = []
+            cell = path
+            while cell != -1 and cell not in live:
+                cells.append(cell)
+                cell = self.cells[cell][0]
+            if rank < len(largest) or len(live) + len(cells) <= self.soft_limit // 2:
+                live.update(cells)
+            else:
+                doomed[path] = largest[od]
+        for flow_set in flow_sets:
+            for od, flows in flow_set.items():
+                for path in [path for path in flows if path in doomed]:
+                    flow = flows.pop(path)
+                    flows[doomed[path]] = flows.get(doomed[path], 0.0) + flow
+                    if flow_set is current:
+                        self.overflow += flow
+        self.collect(flow_sets)
+        if len(self) > self.soft_limit and not self._warned:
+            self._warned = True
+            warnings.warn(f"路径存储无法降到软上限以下: 保留各OD对的最大路径后仍有 {len(self)} 个路径单元 > soft_limit="
+                          f"{self.soft_limit}，其余路径流量已并入各OD对的最大路径", RuntimeWarning, stacklevel=2)
+
+    def collect(self, flow_sets=None):
+        """回收不再被任何路径流量引用的路径单元（标记-清除）"""
+        if flow_sets is None:
+            flow_sets = [self.od_flow]
+        live = set()
+        for flow_set in flow_sets:
+            for flows in flow_set.values():
+                for path in flows:
+                    while path != -1 and path not in live:
+                        live.add(path)
+                        path = self.cells[path][0]
+        for path, cell in enumerate(self.cells):
+            if cell is not None and path not in live:
+                del self._index[cell]
+                self.cells[path] = None
+                self._free.append(path)
+        self._link_paths = None
+
+    def set_flows(self, od_flow):
+        """保存求解得到的路径流量，并回收不再使用的路径单元"""
+        self.od_flow = {od: {path: flow for path, flow in flows.items() if flow > 0}
+                        for od, flows in od_flow.items()}
+        self.collect()
+
+    def od_paths(self, origin, destination):
+        """OD对使用的各条路径 [(有向弧序列, 流量), ...]，按流量从大到小排列"""
+        flows = self.od_flow.get((origin, destination), {})
+        return [(self.links(path), flow) for path, flow in sorted(flows.items(), key=lambda item: -item[1])]
+
+    def link_paths(self, link):
+        """经过该有向弧的已用路径 [((起点, 终点), 路径编号, 流量), ...]"""
+        if self._link_paths is None:
+            self._link_paths = {}
+            for od, flows in self.od_flow.items():
+                for path in flows:
+                    for k in self.links(path):
+                        self._link_paths.setdefault(k, []).append((od, path))
+        return [(od, path, self.od_flow[od][path]) for od, path in self._link_paths.get(link, [])]
+
+    def select_link(self, link):
+        """选定路段分析：经过该有向弧的各OD对及其流量 [(起点, 终点, 流量), ...]，按流量从大到小排列"""
+        result = {}
+        for od, _, flow in self.link_paths(link):
+            result[od] = result.get(od, 0.0) + flow
+        return sorted(((origin, destination, flow) for (origin, destination), flow in result.items()),
+                      key=lambda item: -item[2])
+
+    def link_flows(self, m):
+        """由路径流量重新汇总各有向弧流量（用于核对）"""
+        link_flow = [0.0] * m
+        for flows in self.od_flow.values():
+            for path, flow in flows.items():
+                for k in self.links(path):
+                    link_flow[k] += flow
+        return link_flow
+
+
+def combine_flows(terms):
+    """路径流量的线性组合 sum(系数 × 路径流量)，terms为[(系数, {(起点, 终点): {路径编号: 流量}}), ...]"""
+    result = {}
+    for weight, flow_set in terms:
+        if not weight or flow_set is None:
+            continue
+        for od, flows in flow_set.items():
+            combined = result.setdefault(od, {})
+            for path, flow in flows.items():
+                combined[path] = combined.get(path, 0.0) + weight * flow
+    return result
@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from math import inf, isfinite
+import numpy as np
+from algorithms import TrafficAssignment
+from batch import apply_scenario, edge_lookup, solve
+from datas import Network
+
+# 工作进程共享的基础网络，由_init_worker设置
+_base = {}
+
+
+def _init_worker(network, settings):
+    """工作进程初始化：每个进程只接收一次基础网络；中断信号由主进程处理"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _base['network'] = network
+    _base['settings'] = settings
+    _base['lookup'] = edge_lookup(network)
+
+
+def _reassign(scenario, link_flow=None, current=None):
+    """在工作进程中求解修改后的场景，以当前均衡（如有）作为热启动状态，只返回路段流量和收敛信息
+
+    current: 当前均衡对应的场景，热启动所需的按起点需求在工作进程中由它重新生成
+    """
+    network = apply_scenario(_base['network'], scenario, _base['lookup'])
+    settings = dict(_base['settings'], **scenario.get('settings', {}))
+    # 当前均衡在被关闭的路段上有流量时不能作为初始解
+    warm = link_flow is not None and not np.any((link_flow > 0) & (network.link_capacity <= 0))
+    warm_start = None
+    if warm:
+        origin_demand = {}
+        current_network = apply_scenario(_base['network'], current, _base['lookup'])
+        for origin, destination, amount in current_network.get_demand_data():
+            demand = origin_demand.setdefault(origin, {})
+            demand[destination] = demand.get(destination, 0.0) + amount
+        warm_start = {'link_flow': link_flow, 'origin_demand': origin_demand, 'bushes': None}
+    assignment, link_flow = solve(network, settings, warm_start)
+    return link_flow, assignment.relative_gap(link_flow), assignment.iterations, warm
+
+
+def _number(value):
+    """JSON不支持无穷大，不可达时返回None"""
+    return float(value) if isfinite(value) else None
+
+
+class AssignmentService:
+    """常驻分配服务：编译后的网络和最近一次均衡保留在内存中，通过JSON-lines请求回答查询
+
+    每行一个请求 {"id": ..., "op": ..., ...}，每个请求返回一行 {"id": ..., "ok": true, "result": ...}
+    或 {"id": ..., "ok": false, "error": ...}。请求并发处理，响应按完成顺序返回，用id对应。
+      shortest_path:     from, to, [free_flow] 两节点间的最短路径（默认按当前均衡的拥堵时间）
+      skim:              [origins], [destinations], [free_flow] 最短路径时间矩阵
+      assign:            场景参数（同batch.apply_scenario）及settings、commit、links，在基础网络上重新分配
+      total_travel_time: 当前均衡的路网总出行时间
+      reset:             恢复到基础网络的均衡
+    最短路查询在单独的线程中依次执行，重新分配在进程池中并行执行，互不阻塞；
+    改变当前均衡的请求（commit的assign和reset）按到达顺序依次生效，查询使用此前到达的这些请求生效后的均衡。
+    """
+
+    def __init__(self, network, settings=None, workers=None):
+        self.network = network
+        self.settings = settings or {}
+        self.names = network.get_names()
+        self.lookup = edge_lookup(network)
+        self.workers = workers or os.cpu_count()
+        self._queries = ThreadPoolExecutor(1)
+        self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(network, self.settings))
+
+        # 基础均衡在进程池中求解，同时启动全部工作进程（之后再fork会继承已打开的客户端连接）
+        link_flow, gap, _, _ = self._pool.submit(_reassign, {}).result()
+        self.base_state = self._state({}, network, link_flow, float(gap))
+        self.state = self.base_state
+        # 从commit的assign和reset请求到达起持有，直到当前均衡更新完毕
+        self._state_lock = asyncio.Lock()
+
+    def close(self):
+        """关闭线程池和进程池"""
+        self._queries.shutdown()
+        self._pool.shutdown()
+
+    def _state(self, scenario, network, link_flow, gap):
+        """当前均衡：场景及场景网络、最短路查询用的TrafficAssignment（带树缓存）、路段流量和拥堵时间"""
+        return {'scenario': scenario, 'network': network, 'assignment': TrafficAssignment(network),
+                'link_flow': link_flow,
+                'link_time': network.calculate_congested_time(link_flow),
+                'total_travel_time': float(network.calculate_total_travel_time(link_flow)), 'relative_gap': gap}
+
+    def _node(self, name):
+        """节点名称 -> 节点编号"""
+        if name not in self.network.name_index:
+            raise ValueError(f"未知的节点: {name}")
+        return self.network.name_index[name]
+
+    def _link_time(self, state, request):
+        """查询使用的路段时间：自由流时间或当前均衡的拥堵时间"""
+        if request.get('free_flow'):
+            return np.where(state['network'].link_capacity > 0, state['network'].free_flow_time, inf)
+        return state['link_time']
+
+    def shortest_path(self, state, request):
+        """两节点间的最短路径及其行程时间"""
+        origin, destination = self._node(request['from']), self._node(request['to'])
+        assignment = state['assignment']
+        tree = assignment.shortest_path_tree(self._link_time(state, request), origin)
+        path = assignment.get_path_from_tree(tree, destination)
+        return {'path': [self.names[i] for i in path] if path else None, 'time': _number(tree[0][destination])}
+
+    def skim(self, state, request):
+        """起点×终点的最短路径时间矩阵，缺省起点为有需求的起点、终点为全部节点"""
+        assignment = state['assignment']
+        origins = [self._node(name) for name in request['origins']] if 'origins' in request \
+            else list(assignment.origin_demand)
+        destinations = [self._node(name) for name in request['destinations']] if 'destinations' in request \
+            else list(range(self.network.n))
+        skim = assignment.skim_matrix(self._link_time(state, request), origins, destinations)
+        return {'origins': [self.names[i] for i in origins], 'destinations': [self.names[j] for j in destinations],
+                'times': [[_number(value) for value in row] for row in skim.tolist()]}
+
+    def total_travel_time(self, state, request):
+        """当前均衡的路网总出行时间和相对间隙"""
+        return {'total_travel_time': state['total_travel_time'], 'relative_gap': state['relative_gap']}
+
+    async def assign(self, request):
+        """在进程池中求解修改后的场景；commit为真时将结果作为新的当前均衡"""
+        loop = asyncio.get_running_loop()
+        scenario = {key: request[key] for key in ('demand_factor', 'demand', 'capacity', 'capacity_factor',
+                                                  'closed', 'settings') if key in request}
+        current = self.state
+        link_flow, gap, iterations, warm = await loop.run_in_executor(
+            self._pool, _reassign, scenario, current['link_flow'], current['scenario'])
+        # 工作进程只返回流量，场景网络在主进程中重新生成（不占用事件循环）
+        network = await loop.run_in_executor(None, apply_scenario, self.network, scenario, self.lookup)
+
+        result = {'total_travel_time': float(network.calculate_total_travel_time(link_flow)),
+                  'relative_gap': float(gap), 'iterations': iterations, 'warm_start': warm}
+        if request.get('links'):
+            link_time = network.calculate_congested_time(link_flow)
+            result['links'] = [[self.names[i], self.names[j], flow, _number(time)] for i, j, flow, time in
+                               zip(network.link_from.tolist(), network.link_to.tolist(), link_flow.tolist(),
+                                   link_time.tolist())]
+        if request.get('commit'):
+            self.state = await loop.run_in_executor(None, self._state, scenario, network, link_flow, float(gap))
+        return result
+
+    async def handle(self, line):
+        """处理一行请求，返回一行响应"""
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            op = request.get('op')
+            if op == 'assign' and request.get('commit'):
+                async with self._state_lock:
+                    result = await self.assign(request)
+            elif op == 'assign':
+                result = await self.assign(request)
+            elif op == 'reset':
+                async with self._state_lock:
+                    self.state = self.base_state
+                    result = self.total_travel_time(self.state, request)
+            elif op in ('shortest_path', 'skim', 'total_travel_time'):
+                # 等待此前到达的commit和reset完成后取当前均衡，查询期间不受随后提交的重新分配影响
+                async with self._state_lock:
+                    state = self.state
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._queries, getattr(self, op), state, request)
+            else:
+                raise ValueError(f"未知的请求类型: {op}")
+            response = {'id': request_id, 'ok': True, 'result': result}
+        except Exception as exc:
+            response = {'id': request_id, 'ok': False, 'error': f"{type(exc).__name__}: {exc}"}
+        return json.dumps(response, ensure_ascii=False)
+
+    async def _serve(self, reader, write):
+        """逐行读取请求，每个请求作为独立任务并发处理；输入结束后等待未完成的请求"""
+        async def respond(line):
+            write(await self.handle(line) + '\n')
+
+        tasks = set()
+        while line := await reader.readline():
+            if line.strip():
+                task = asyncio.create_task(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def serve_stdin(self):
+        """从标准输入读取请求，响应写到标准输出"""
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=2 ** 26)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+        def write(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+        await self._serve(reader, write)
+
+    async def serve_socket(self, path):
+        """在本地Unix套接字上接受连接，每个连接内按行收发请求"""
+        async def connection(reader, writer):
+            try:
+                await self._serve(reader, lambda text: writer.write(text.encode('utf-8')))
+                await writer.drain()
+            finally:
+                writer.close()
+
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(connection, path, limit=2 ** 26)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            os.remove(path)
+
+
+def main():
+    """命令行入口: python service.py network.json demand.json [--socket /tmp/assignment.sock]"""
+    parser = argparse.ArgumentParser(description='常驻交通分配服务（JSON-lines请求）')
+    parser.add_argument('network', nargs='?', default='network.json')
+    parser.add_argument('demand', nargs='?', default='demand.json')
+    parser.add_argument('--socket', help='Unix套接字路径，缺省时使用标准输入输出')
+    parser.add_argument('--workers', type=int, help='重新分配使用的进程数')
+    parser.add_argument('--method', default='bfw')
+    parser.add_argument('--target-gap', type=float, default=1e-4)
+    parser.add_argument('--max-iterations', type=int, default=100)
+    parser.add_argument('--cache-dir', default='.cache')
+    args = parser.parse_args()
+
+    network = Network(args.network, args.demand, cache_dir=args.cache_dir)
+    settings = {'method': args.method, 'target_gap': args.target_gap, 'max_iterations': args.max_iterations}
+    service = AssignmentService(network, settings, args.workers)
+    # 标准输出用于响应，提示信息写到标准错误
+    print(f"基础均衡: 路网总出行时间={service.state['total_travel_time']:.1f} 分钟, "
+          f"相对间隙={service.state['relative_gap']:.2e}, 等待请求", file=sys.stderr)
+    try:
+        asyncio.run(service.serve_socket(args.socket) if args.socket else service.serve_stdin())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+from heapq import heappop, heappush
+from math import exp, inf
+
+
+def dijkstra(first_out, link_to, link_time, origin):
+    """二叉堆Dijkstra算法，返回(距离, 前驱弧, 节点确定顺序)，参数均为Python列表"""
+    n = len(first_out) - 1
+    dist = [inf] * n
+    pred = [-1] * n # 到达各节点的有向弧编号
+    order = []
+    dist[origin] = 0
+    heap = [(0, origin)]
+    while heap:
+        d, i = heappop(heap)
+        if d > dist[i]:
+            continue
+        order.append(i)
+        for k in range(first_out[i], first_out[i + 1]):
+            j = link_to[k]
+            new_dist = d + link_time[k]
+            if new_dist < dist[j]:
+                dist[j] = new_dist
+                pred[j] = k
+                heappush(heap, (new_dist, j))
+    return dist, pred, order
+
+
+def load_tree(link_from, tree, demand, link_flow, scale=1.0):
+    """沿最短路径树将一个起点的全部需求（终点编号数组, 需求量数组）一次性加载到路段流量上"""
+    _, pred, order = tree
+    node_flow = [0.0] * len(pred)
+    destinations, amounts = demand
+    for destination, amount in zip(destinations.tolist(), amounts.tolist()):
+        node_flow[destination] += amount * scale
+
+    # 按距离从远到近回溯，子节点流量累加到前驱弧和父节点
+    for i in reversed(order):
+        k = pred[i]
+        if k != -1 and node_flow[i]:
+            link_flow[k] += node_flow[i]
+            node_flow[link_from[k]] += node_flow[i]
+
+
+def repair_tree(first_out, link_from, link_to, in_links, link_time, tree, removed):
+    """删除若干有向弧（其link_time已设为inf）后修复最短路径树，只重新计算被删除树弧下游子树中的节点
+
+    in_links: 各节点的入弧编号列表。返回新的(距离, 前驱弧, 节点确定顺序)，被删除的弧均不在树中时直接返回原树。
+    """
+    dist, pred, order = tree
+    roots = [link_to[k] for k in removed if pred[link_to[k]] == k]
+    if not roots:
+        return tree
+
+    # 受影响节点：以被删除树弧为根的子树（按确定顺序一次扫描，父节点先于子节点）
+    affected = [False] * len(pred)
+    for i in roots:
+        affected[i] = True
+    for i in order:
+        k = pred[i]
+        if k != -1 and affected[link_from[k]]:
+            affected[i] = True
+
+    # 受影响节点先由未受影响的入弧起点得到初始标号，再在受影响节点间执行Dijkstra
+    dist, pred = dist[:], pred[:]
+    heap = []
+    for i in order:
+        if affected[i]:
+            dist[i], pred[i] = inf, -1
+            for k in in_links[i]:
+                j = link_from[k]
+                if not affected[j] and dist[j] + link_time[k] < dist[i]:
+                    dist[i] = dist[j] + link_time[k]
+                    pred[i] = k
+            if pred[i] != -1:
+                heappush(heap, (dist[i], i))
+
+    repaired = []
+    while heap:
+        d, i = heappop(heap)
+        if d > dist[i]:
+            continue
+        repaired.append(i)
+        for k in range(first_out[i], first_out[i + 1]):
+            j = link_to[k]
+            new_dist = d + link_time[k]
+            if affected[j] and new_dist < dist[j]:
+                dist[j] = new_dist
+                pred[j] = k
+                heappush(heap, (new_dist, j))
+    return dist, pred, [i for i in order if not affected[i]] + repaired
+
+
+def dial_load(first_out, link_to, link_time, tree, demand, link_flow, theta, scale=1.0):
+    """Dial STOCH单次logit加载：不枚举路径，按logit模型将一个起点的需求加载到有效弧（远离起点的弧）上
+
+    tree为该起点的最短路径树，theta为logit离散参数（1/分钟），越大越接近全有全无加载。
+    """
+    dist, _, order = tree
+    position = [-1] * len(dist)
+    for index, i in enumerate(order):
+        position[i] = index
+
+    # 正向：按距离从近到远计算有效弧权重 w(i,j) = W(i) × exp(theta × (r(j) - r(i) - t(i,j)))，W(j)为入弧权重之和
+    node_weight = [0.0] * len(dist)
+    node_weight[order[0]] = 1.0
+    weight = {}
+    for i in order:
+        base = node_weight[i]
+        if not base:
+            continue
+        for k in range(first_out[i], first_out[i + 1]):
+            j = link_to[k]
+            if position[j] > position[i]:
+                w = base * exp(theta * (dist[j] - dist[i] - link_time[k]))
+                if w:
+                    weight[k] = w
+                    node_weight[j] += w
+
+    # 反向：按距离从远到近，节点流量按入弧权重比例分配到各入弧
+    node_flow = [0.0] * len(dist)
+    destinations, amounts = demand
+    for destination, amount in zip(destinations.tolist(), amounts.tolist()):
+        node_flow[destination] += amount * scale
+    for i in reversed(order):
+        for k in range(first_out[i], first_out[i + 1]):
+            w = weight.get(k)
+            if w:
+                j = link_to[k]
+                flow = node_flow[j] * w / node_weight[j]
+                link_flow[k] += flow
+                node_flow[i] += flow
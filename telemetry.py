@@ -0,0 +1,83 @@
+import json
+import time
+import tracemalloc
+
+
+class SolverMonitor:
+    """求解过程监视器：为每次迭代生成结构化记录（相对间隙、Beckmann目标函数、步长、各阶段用时、内存分配），
+    写入JSON-lines日志并交给回调函数，回调返回True时求解器提前停止
+
+    用法: assignment.frank_wolfe_assignment(monitor=SolverMonitor('fw.jsonl', callback))
+    """
+
+    def __init__(self, log_file=None, callback=None, trace_memory=False):
+        self.log_file = log_file
+        self.callback = callback
+        # 开启后用tracemalloc统计每次迭代的Python内存分配峰值（会明显拖慢求解）
+        self.trace_memory = trace_memory
+        self.records = []
+
+    def start(self, assignment, solver, **settings):
+        """求解开始时调用，记录网络规模和求解参数"""
+        self.solver = solver
+        self.iteration_count = 0
+        self._started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self._emit({'event': 'start', 'solver': solver, 'nodes': assignment.n, 'links': assignment.m,
+                    'od_pairs': len(assignment.network.demand_amount), **settings})
+        self._phase_start = dict(assignment.timings)
+        self._phase_last = dict(assignment.timings)
+        self._start = self._last = time.perf_counter()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+    def iteration(self, assignment, link_flow, gap=None, step_size=None, objective=None, **extra):
+        """每次迭代调用一次，返回True表示回调要求提前停止
+
+        gap为当前流量的相对间隙，step_size为得到当前流量所用的步长（或加载比例），
+        objective为求解器已由evaluate_costs算出的目标函数值（缺省时重新计算），extra为求解器特有的收敛指标
+        """
+        if objective is None:
+            objective = assignment.network.evaluate_costs(link_flow)[2]
+        now = time.perf_counter()
+        timings = assignment.timings
+        phase_time = {key: timings[key] - self._phase_last[key] for key in timings}
+        record = {'event': 'iteration', 'solver': self.solver, 'iteration': self.iteration_count,
+                  'relative_gap': None if gap is None else float(gap),
+                  'objective': float(objective),
+                  'step_size': None if step_size is None else float(step_size),
+                  'elapsed': now - self._start, 'iteration_time': now - self._last,
+                  'phase_time': phase_time, 'other_time': now - self._last - sum(phase_time.values()), **extra}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            record['memory_current_mb'], record['memory_peak_mb'] = current / 2 ** 20, peak / 2 ** 20
+
+        stop = bool(self.callback(record)) if self.callback is not None else False
+        record['stop'] = stop
+        self._emit(record)
+
+        # 记录和回调的开销不计入下一次迭代
+        self.iteration_count += 1
+        self._phase_last = dict(timings)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self._last = time.perf_counter()
+        return stop
+
+    def finish(self, assignment, link_flow):
+        """求解结束时调用，记录迭代次数、总用时和各阶段累计用时"""
+        timings = assignment.timings
+        self._emit({'event': 'finish', 'solver': self.solver, 'iterations': assignment.iterations,
+                    'elapsed': time.perf_counter() - self._start,
+                    'objective': float(assignment.network.calculate_beckmann_objective(link_flow)),
+                    'phase_time': {key: timings[key] - self._phase_start[key] for key in timings}})
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def _emit(self, record):
+        """保存记录并追加到日志文件"""
+        self.records.append(record)
+        if self.log_file:
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
@@ -1,77 +1,144 @@
-import matplotlib.pyplot as plt
-import matplotlib
+import json
+import os
+from html import escape
+from multiprocessing import Pool
 import numpy as np
 from datas import Network
 
-# 设置中文字体支持
-plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
-plt.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
+_plt = None
+
+# 工作进程中的可视化对象，由_init_worker设置
+_worker = {}
+
+
+def _pyplot():
+    """首次绘图时才导入matplotlib，避免不绘图时的导入开销"""
+    global _plt
+    if _plt is None:
+        import matplotlib.pyplot as plt
+
+        # 设置中文字体支持
+        plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+        plt.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
+        _plt = plt
+    return _plt
+
+
+def _init_worker(visualization):
+    """绘图工作进程初始化：使用非交互后端，每个进程只接收一次可视化对象"""
+    _pyplot().switch_backend('Agg')
+    _worker['visualization'] = visualization
+
+
+def _render(task):
+    """在工作进程中绘制并保存一张流量图"""
+    link_flow, title, filename, dpi = task
+    visualization = _worker['visualization']
+    fig, _ = visualization.plot_network(link_flow, title)
+    fig.savefig(filename, dpi=dpi, bbox_inches='tight')
+    _pyplot().close(fig)
+    return filename
 
 
 class NetworkVisualization:
+    # 流量标注数量上限，超过时只标注流量最大的路段；节点名称在节点数超过上限时不标注
+    max_flow_labels = 200
+    max_node_labels = 200
+
     def __init__(self, network: Network):
         self.network = network
         self.names = network.get_names()
         self.x, self.y = network.get_coordinates()
-        self.adjacency = network.get_adjacency_matrix()
+        self.edge_nodes = network.get_edge_nodes()
         self.n = network.n
-    
-    def plot_network(self, flow_matrix=None, title="交通网络"):
-        """绘制交通网络图，可选显示流量"""
-        fig, ax = plt.subplots(figsize=(12, 10))
-        
+        x, y = np.asarray(self.x, dtype=float), np.asarray(self.y, dtype=float)
+        # 各路段两端点坐标 (路段数, 2, 2)
+        self.segments = np.stack([np.stack([x[self.edge_nodes[:, 0]], y[self.edge_nodes[:, 0]]], axis=1),
+                                  np.stack([x[self.edge_nodes[:, 1]], y[self.edge_nodes[:, 1]]], axis=1)], axis=1)
+
+    def _edge_style(self, link_flow, max_width):
+        """计算各路段的流量（双向之和）、归一化流量和线宽"""
+        if link_flow is None:
+            edge_flow = np.zeros(len(self.edge_nodes))
+        else:
+            edge_flow = self.network.get_edge_flow(link_flow)
+        max_flow = link_flow.max() if link_flow is not None and link_flow.any() else 1
+        # 归一化流量到[0, 1]范围
+        normalized_flow = np.clip(edge_flow / max_flow, 0.0, 1.0) if max_flow > 0 else np.zeros(len(edge_flow))
+        normalized_flow[edge_flow <= 0] = 0.0
+        linewidth = np.where(edge_flow > 0, 1 + (max_width - 1) * normalized_flow, 1.0)
+        return edge_flow, max_flow, normalized_flow, linewidth
+
+    def _visible(self, points, extent):
+        """判断各点是否位于显示范围 (xmin, xmax, ymin, ymax) 内"""
+        if extent is None:
+            return np.ones(len(points), dtype=bool)
+        xmin, xmax, ymin, ymax = extent
+        return (points[:, 0] >= xmin) & (points[:, 0] <= xmax) & (points[:, 1] >= ymin) & (points[:, 1] <= ymax)
+
+    def _draw(self, ax, link_flow, node_size, font_size, max_width, label_offset, label_pad, extent=None,
+              label_threshold=0.0):
+        """在一个坐标轴上绘制路网：全部路段作为一个LineCollection，全部节点一次scatter，标注按范围和阈值裁剪"""
+        plt = _pyplot()
+        from matplotlib.collections import LineCollection
+
+        edge_flow, max_flow, normalized_flow, linewidth = self._edge_style(link_flow, max_width)
+
+        # 根据流量确定边的颜色和粗细
+        colors = plt.cm.Reds(normalized_flow)
+        colors[edge_flow <= 0] = (0.5, 0.5, 0.5, 1.0) # gray
+        ax.add_collection(LineCollection(self.segments, colors=colors, linewidths=linewidth, zorder=1))
+
         # 绘制节点
-        for i in range(self.n):
-            ax.scatter(self.x[i], self.y[i], s=500, c='lightblue', edgecolors='black', zorder=2)
-            ax.text(self.x[i], self.y[i], self.names[i], fontsize=12, ha='center', va='center', fontweight='bold')
-        
-        # 绘制边和流量
-        max_flow = max([max(row) for row in flow_matrix]) if flow_matrix and any(any(row) for row in flow_matrix) else 1
-        
-        for i in range(self.n):
-            for j in range(i + 1, self.n):
-                if self.adjacency[i][j]:
-                    # 计算边的流量（双向之和）
-                    flow = 0
-                    if flow_matrix:
-                        flow = flow_matrix[i][j] + flow_matrix[j][i]
-                    
-                    # 根据流量确定边的颜色和粗细
-                    if flow > 0:
-                        # 归一化流量到[0, 1]范围
-                        normalized_flow = min(flow / max_flow, 1.0) if max_flow > 0 else 0
-                        color = plt.cm.Reds(normalized_flow)
-                        linewidth = 1 + 4 * normalized_flow  # 线宽从1到5
-                    else:
-                        color = 'gray'
-                        linewidth = 1
-                    
-                    # 绘制边
-                    ax.plot([self.x[i], self.x[j]], [self.y[i], self.y[j]], 
-                           color=color, linewidth=linewidth, zorder=1)
-                    
-                    # 标注流量
-                    if flow > 0:
-                        mid_x = (self.x[i] + self.x[j]) / 2
-                        mid_y = (self.y[i] + self.y[j]) / 2
-                        ax.text(mid_x, mid_y + 0.5, f'{flow:.0f}', 
-                               fontsize=10, ha='center', bbox=dict(boxstyle="round,pad=0.3", facecolor="white", alpha=0.8))
-        
+        points = np.column_stack([self.x, self.y]).astype(float)
+        ax.scatter(points[:, 0], points[:, 1], s=node_size, c='lightblue', edgecolors='black', zorder=2)
+        visible = self._visible(points, extent)
+        if visible.sum() <= self.max_node_labels:
+            for i in np.flatnonzero(visible).tolist():
+                ax.text(self.x[i], self.y[i], self.names[i], fontsize=font_size, ha='center', va='center',
+                        fontweight='bold')
+
+        # 标注流量：只标注显示范围内超过阈值的路段，数量超过上限时保留流量最大的路段
+        middle = self.segments.mean(axis=1)
+        labeled = np.flatnonzero((edge_flow > max(label_threshold, 0)) & self._visible(middle, extent))
+        if len(labeled) > self.max_flow_labels:
+            labeled = labeled[np.argsort(-edge_flow[labeled], kind='stable')[:self.max_flow_labels]]
+        for z in np.sort(labeled).tolist():
+            ax.text(middle[z, 0], middle[z, 1] + label_offset, f'{edge_flow[z]:.0f}', fontsize=font_size - 2,
+                    ha='center', bbox=dict(boxstyle=f"round,pad={label_pad}", facecolor="white", alpha=0.8))
+
+        if extent is not None:
+            ax.set_xlim(extent[0], extent[1])
+            ax.set_ylim(extent[2], extent[3])
+        else:
+            ax.autoscale_view()
+        ax.grid(True, linestyle='--', alpha=0.7)
+        ax.set_aspect('equal')
+        return max_flow
+
+    def plot_network(self, link_flow=None, title="交通网络", extent=None, label_threshold=0.0):
+        """绘制交通网络图，可选显示流量
+
+        extent: 显示范围 (xmin, xmax, ymin, ymax)，范围外的标注不绘制
+        label_threshold: 流量不超过该值的路段不标注
+        """
+        plt = _pyplot()
+        fig, ax = plt.subplots(figsize=(12, 10))
+        max_flow = self._draw(ax, link_flow, 500, 12, 5, 0.5, 0.3, extent, label_threshold)
+
         # 设置图表属性
         ax.set_title(title, fontsize=16, fontweight='bold')
         ax.set_xlabel('X坐标 (km)', fontsize=12)
         ax.set_ylabel('Y坐标 (km)', fontsize=12)
-        ax.grid(True, linestyle='--', alpha=0.7)
-        ax.set_aspect('equal')
-        
+
         # 添加图例
-        if flow_matrix and any(any(row) for row in flow_matrix):
+        if link_flow is not None and link_flow.any():
             # 创建流量图例
             legend_elements = []
             flow_values = [0, max_flow * 0.25, max_flow * 0.5, max_flow * 0.75, max_flow]
-            labels = ['0', f'{max_flow * 0.25:.0f}', f'{max_flow * 0.5:.0f}', 
-                     f'{max_flow * 0.75:.0f}', f'{max_flow:.0f}']
-            
+            labels = ['0', f'{max_flow * 0.25:.0f}', f'{max_flow * 0.5:.0f}',
+                      f'{max_flow * 0.75:.0f}', f'{max_flow:.0f}']
+
             for flow_val, label in zip(flow_values, labels):
                 if flow_val == 0:
                     color = 'gray'
@@ -80,71 +147,105 @@ class NetworkVisualization:
                     normalized_flow = flow_val / max_flow
                     color = plt.cm.Reds(normalized_flow)
                     linewidth = 1 + 4 * normalized_flow
-                
-                legend_elements.append(plt.Line2D([0], [0], color=color, linewidth=linewidth, 
-                                                label=f'流量: {label} 辆/小时'))
-            
+
+                legend_elements.append(plt.Line2D([0], [0], color=color, linewidth=linewidth,
+                                                  label=f'流量: {label} 辆/小时'))
+
             ax.legend(handles=legend_elements, loc='upper right', bbox_to_anchor=(1.15, 1))
-        
+
         plt.tight_layout()
         return fig, ax
-    
-    def compare_algorithms(self, flow_matrices, algorithm_names):
+
+    def compare_algorithms(self, link_flows, algorithm_names, extent=None, label_threshold=0.0):
         """比较不同算法的分配结果"""
+        plt = _pyplot()
         fig, axes = plt.subplots(2, 2, figsize=(20, 16))
         axes = axes.flatten()
-        
-        for idx, (flow_matrix, algorithm_name) in enumerate(zip(flow_matrices, algorithm_names)):
-            ax = axes[idx]
-            
-            # 绘制节点
-            for i in range(self.n):
-                ax.scatter(self.x[i], self.y[i], s=300, c='lightblue', edgecolors='black', zorder=2)
-                ax.text(self.x[i], self.y[i], self.names[i], fontsize=10, ha='center', va='center', fontweight='bold')
-            
-            # 绘制边和流量
-            max_flow = max([max(row) for row in flow_matrix]) if flow_matrix and any(any(row) for row in flow_matrix) else 1
-            
-            for i in range(self.n):
-                for j in range(i + 1, self.n):
-                    if self.adjacency[i][j]:
-                        # 计算边的流量（双向之和）
-                        flow = 0
-                        if flow_matrix:
-                            flow = flow_matrix[i][j] + flow_matrix[j][i]
-                        
-                        # 根据流量确定边的颜色和粗细
-                        if flow > 0:
-                            normalized_flow = min(flow / max_flow, 1.0) if max_flow > 0 else 0
-                            color = plt.cm.Reds(normalized_flow)
-                            linewidth = 1 + 3 * normalized_flow
-                        else:
-                            color = 'gray'
-                            linewidth = 1
-                        
-                        # 绘制边
-                        ax.plot([self.x[i], self.x[j]], [self.y[i], self.y[j]], 
-                               color=color, linewidth=linewidth, zorder=1)
-                        
-                        # 标注流量
-                        if flow > 0:
-                            mid_x = (self.x[i] + self.x[j]) / 2
-                            mid_y = (self.y[i] + self.y[j]) / 2
-                            ax.text(mid_x, mid_y + 0.3, f'{flow:.0f}', 
-                                   fontsize=8, ha='center', bbox=dict(boxstyle="round,pad=0.2", facecolor="white", alpha=0.8))
-            
+
+        for ax, link_flow, algorithm_name in zip(axes, link_flows, algorithm_names):
+            self._draw(ax, link_flow, 300, 10, 4, 0.3, 0.2, extent, label_threshold)
+
             # 设置子图属性
-            total_time = self.network.calculate_total_travel_time(flow_matrix)
+            total_time = self.network.calculate_total_travel_time(link_flow)
             ax.set_title(f'{algorithm_name}\n总出行时间: {total_time:.1f} 分钟', fontsize=12, fontweight='bold')
             ax.set_xlabel('X坐标 (km)', fontsize=10)
             ax.set_ylabel('Y坐标 (km)', fontsize=10)
-            ax.grid(True, linestyle='--', alpha=0.7)
-            ax.set_aspect('equal')
-        
+
         plt.tight_layout()
         return fig, axes
-    
-    def save_plot(self, fig, filename):
+
+    def save_plots(self, link_flows, titles, filenames, workers=None, dpi=300):
+        """分别绘制并保存多个流量图，workers > 1 时在多个进程中并行绘制"""
+        tasks = [(link_flow, title, filename, dpi) for link_flow, title, filename in zip(link_flows, titles, filenames)]
+        workers = min(workers or os.cpu_count(), len(tasks))
+        if workers > 1:
+            with Pool(workers, initializer=_init_worker, initargs=(self,)) as pool:
+                saved = pool.map(_render, tasks)
+        else:
+            _worker['visualization'] = self
+            saved = [_render(task) for task in tasks]
+        for filename in saved:
+            print(f"图表已保存到 {filename}")
+
+    def save_plot(self, fig, filename, dpi=300):
         """保存图表到文件"""
-        fig.savefig(filename, dpi=300, bbox_inches='tight')
-        print(f"图表已保存到 {filename}")
\ No newline at end of file
+        fig.savefig(filename, dpi=dpi, bbox_inches='tight')
+        print(f"图表已保存到 {filename}")
+
+    def export_geojson(self, filename, link_flow=None):
+        """导出GeoJSON（节点为Point，路段为LineString，属性含双向流量），坐标直接使用网络坐标"""
+        edge_flow = self._edge_style(link_flow, 5)[0]
+        features = [{'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [x, y]},
+                     'properties': {'name': name}}
+                    for name, x, y in zip(self.names, self.x, self.y)]
+        for (i, j), segment, flow in zip(self.edge_nodes.tolist(), self.segments.tolist(), edge_flow.tolist()):
+            features.append({'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': segment},
+                             'properties': {'from': self.names[i], 'to': self.names[j], 'flow': round(flow, 3)}})
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f, ensure_ascii=False)
+        print(f"GeoJSON已保存到 {filename}")
+
+    def export_svg(self, filename, link_flow=None, width=1000, node_labels=None):
+        """导出轻量SVG矢量图：路段按流量着色和加粗，不经过matplotlib绘图
+
+        node_labels: 是否标注节点名称，缺省时节点数不超过max_node_labels才标注
+        """
+        from matplotlib import colormaps
+
+        edge_flow, _, normalized_flow, linewidth = self._edge_style(link_flow, 5)
+        colors = (colormaps['Reds'](normalized_flow)[:, :3] * 255).round().astype(int)
+        colors[edge_flow <= 0] = 128
+
+        # 网络坐标映射到画布坐标（y轴向下）
+        points = np.column_stack([self.x, self.y]).astype(float)
+        low, high = points.min(axis=0), points.max(axis=0)
+        scale = (width - 40) / max(high[0] - low[0], high[1] - low[1], 1e-9)
+        height = int((high[1] - low[1]) * scale) + 40
+        canvas = np.empty_like(points)
+        canvas[:, 0] = 20 + (points[:, 0] - low[0]) * scale
+        canvas[:, 1] = height - 20 - (points[:, 1] - low[1]) * scale
+        segments = canvas[self.edge_nodes]
+
+        lines = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">',
+                 f'<rect width="{width}" height="{height}" fill="white"/>', '<g stroke-linecap="round">']
+        # 流量小的路段先画，流量大的路段在上层
+        for z in np.argsort(edge_flow, kind='stable').tolist():
+            (x1, y1), (x2, y2) = segments[z].tolist()
+            r, g, b = colors[z].tolist()
+            lines.append(f'<line x1="{x1:.1f}" y1="{y1:.1f}" x2="{x2:.1f}" y2="{y2:.1f}" '
+                         f'stroke="rgb({r},{g},{b})" stroke-width="{linewidth[z]:.2f}"/>')
+        lines.append('</g><g fill="lightblue" stroke="black">')
+        radius = 4 if self.n > self.max_node_labels else 8
+        lines.extend(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="{radius}"/>' for x, y in canvas.tolist())
+        lines.append('</g>')
+        if node_labels is None:
+            node_labels = self.n <= self.max_node_labels
+        if node_labels:
+            lines.append('<g font-size="10" text-anchor="middle" dominant-baseline="central">')
+            lines.extend(f'<text x="{x:.1f}" y="{y:.1f}">{escape(name)}</text>'
+                         for name, (x, y) in zip(self.names, canvas.tolist()))
+            lines.append('</g>')
+        lines.append('</svg>')
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+        print(f"SVG已保存到 {filename}")
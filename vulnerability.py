@@ -0,0 +1,205 @@
+import copy
+import csv
+import os
+import sys
+from math import inf
+from multiprocessing import Pool
+import numpy as np
+from algorithms import TrafficAssignment
+from datas import Network
+from paths import PathStore
+from shortest_path import load_tree, repair_tree
+
+# 工作进程共享的基础均衡状态，由_init_worker设置
+_base = {}
+
+
+def solve_base(network, method='bfw', max_iterations=100, target_gap=1e-4, soft_limit=1000000):
+    """求解基础均衡并记录各OD对的路径流量，作为各路段关闭场景的出发点"""
+    assignment = TrafficAssignment(network)
+    path_store = PathStore(assignment, soft_limit)
+    link_flow = assignment.frank_wolfe_assignment(max_iterations, target_gap, method, path_store=path_store)
+    return {'link_flow': link_flow, 'path_store': path_store,
+            'total_travel_time': network.calculate_total_travel_time(link_flow),
+            'relative_gap': assignment.relative_gap(link_flow)}
+
+
+def _init_worker(network, state, settings):
+    """工作进程初始化：每个进程只接收一次基础网络和基础均衡，并计算基础均衡下各起点的最短路径树"""
+    assignment = TrafficAssignment(network)
+    link_time = network.calculate_congested_time(state['link_flow']).tolist()
+    in_links = [[] for _ in range(network.n)]
+    for k, j in enumerate(assignment.link_to):
+        in_links[j].append(k)
+    edge_links = {}
+    for k, z in enumerate(network.link_edge.tolist()):
+        edge_links.setdefault(z, []).append(k)
+
+    _base.update(network=network, state=state, settings=settings, assignment=assignment, link_time=link_time,
+                 in_links=in_links, edge_links=edge_links, trees=assignment.shortest_path_trees(link_time))
+
+
+def close_edge(network, z):
+    """生成关闭路段z（双向）的场景网络：浅复制基础网络，只替换通行能力数组"""
+    closed = copy.copy(network)
+    closed.link_capacity = np.where(network.link_edge == z, 0.0, network.link_capacity)
+    return closed
+
+
+def reroute(z):
+    """关闭路段z：经过该路段的路径流量在修复后的最短路径树上重新加载，返回(可行初始流量, 改道需求量, 断开需求量)
+
+    只有以该路段为树弧的起点需要修复最短路径树，且只重新计算被切断的子树。
+    路径存储合并过路径（overflow > 0）或扣除的路径流量与关闭路段上的流量不符时，路径流量不能准确给出
+    经过该路段的需求，改为在修复后的树上重新加载全部需求。
+    """
+    assignment, state = _base['assignment'], _base['state']
+    path_store = state['path_store']
+    removed = _base['edge_links'][z]
+    link_time = list(_base['link_time'])
+    for k in removed:
+        link_time[k] = inf
+    if path_store.overflow > 0:
+        return _reload_all(removed, link_time)
+
+    # 从基础均衡中扣除经过关闭路段的路径流量，按起点汇总需改道的需求
+    link_flow = state['link_flow'].copy()
+    demand, seen = {}, set()
+    for k in removed:
+        for (origin, destination), path, flow in path_store.link_paths(k):
+            if path in seen:
+                continue
+            seen.add(path)
+            link_flow[path_store.links(path)] -= flow
+            amounts = demand.setdefault(origin, {})
+            amounts[destination] = amounts.get(destination, 0.0) + flow
+
+    # 扣除后关闭路段上只应剩下舍入误差
+    if np.any(np.abs(link_flow[removed]) > 1e-6 * max(1.0, state['link_flow'][removed].max())):
+        return _reload_all(removed, link_time)
+    link_flow[removed] = 0.0
+    link_flow = np.maximum(link_flow, 0.0).tolist()
+    rerouted = disconnected = 0.0
+    for origin, amounts in demand.items():
+        destinations = np.array(list(amounts), dtype=np.int64)
+        amount = np.array(list(amounts.values()))
+        rerouted += amount.sum()
+        disconnected += _load_repaired(origin, (destinations, amount), removed, link_time, link_flow)
+    return np.array(link_flow), rerouted, disconnected
+
+
+def _load_repaired(origin, demand, removed, link_time, link_flow):
+    """在修复后的最短路径树上加载一个起点的需求，返回不可达终点的需求量"""
+    assignment = _base['assignment']
+    tree = repair_tree(assignment.first_out, assignment.link_from, assignment.link_to, _base['in_links'],
+                       link_time, _base['trees'][origin], removed)
+    destinations, amount = demand
+    reachable = np.array([tree[0][j] < inf for j in destinations.tolist()], dtype=bool)
+    load_tree(assignment.link_from, tree, (destinations[reachable], amount[reachable]), link_flow)
+    return amount[~reachable].sum()
+
+
+def _reload_all(removed, link_time):
+    """路径流量不可用时的初始流量：全部需求在修复后的最短路径树上全有全无加载
+
+    改道需求量取基础均衡中关闭路段上的流量；关闭路段上没有流量时直接沿用基础均衡。
+    """
+    assignment, state = _base['assignment'], _base['state']
+    rerouted = float(state['link_flow'][removed].sum())
+    if rerouted <= 0:
+        # 关闭路段上没有流量时基础均衡仍是均衡
+        return state['link_flow'].copy(), 0.0, 0.0
+    link_flow = [0.0] * assignment.m
+    disconnected = 0.0
+    for origin, demand in assignment.origin_demand.items():
+        disconnected += _load_repaired(origin, demand, removed, link_time, link_flow)
+    return np.array(link_flow), rerouted, disconnected
+
+
+def _evaluate(z):
+    """在工作进程中评估关闭单条路段（双向）的影响"""
+    network, state, settings = _base['network'], _base['state'], _base['settings']
+    c1, c2 = network.between[z]
+    closed = close_edge(network, z)
+    link_flow, rerouted, disconnected = reroute(z)
+
+    row = {'edge': f"{c1}-{c2}", 'rerouted_demand': rerouted, 'disconnected_demand': disconnected,
+           'iterations': 0, 'relative_gap': None}
+    if disconnected > 0:
+        # 关闭后部分OD对不连通，总出行时间视为无穷大
+        total_time = inf
+    elif rerouted > 0 and settings.get('reequilibrate', True):
+        # 以改道后的可行流量热启动，重新求解均衡
+        assignment = TrafficAssignment(closed)
+        link_flow = assignment.frank_wolfe_assignment(settings.get('max_iterations', 100),
+                                                      settings.get('target_gap', 1e-4),
+                                                      settings.get('method', 'bfw'), initial_flow=link_flow)
+        row['iterations'] = assignment.iterations
+        row['relative_gap'] = assignment.relative_gap(link_flow)
+        total_time = closed.calculate_total_travel_time(link_flow)
+    else:
+        # 路段在均衡中未被使用时关闭不改变均衡；不重新求解时为固定拥堵时间下改道的估计值
+        total_time = closed.calculate_total_travel_time(link_flow)
+
+    row['total_travel_time'] = total_time
+    row['increase'] = total_time - state['total_travel_time']
+    return row
+
+
+def rank_critical_links(network, edges=None, settings=None, workers=None, state=None):
+    """关键路段排序：从基础均衡出发逐一关闭路段，按路网总出行时间增加量从大到小排列
+
+    edges: 要评估的路段编号，缺省为全部路段
+    settings: method / max_iterations / target_gap（求解设置），reequilibrate（是否重新求解均衡，默认是）
+    state: solve_base() 的结果，缺省时先求解基础均衡
+    返回(基础状态, 排序后的结果行列表)
+    """
+    settings = settings or {}
+    if state is None:
+        state = solve_base(network, settings.get('method', 'bfw'), settings.get('max_iterations', 100),
+                           settings.get('target_gap', 1e-4))
+    edges = list(range(len(network.between))) if edges is None else list(edges)
+
+    workers = min(workers or os.cpu_count(), max(len(edges), 1))
+    if workers > 1:
+        with Pool(workers, initializer=_init_worker, initargs=(network, state, settings)) as pool:
+            rows = pool.map(_evaluate, edges, chunksize=max(len(edges) // (workers * 4), 1))
+    else:
+        _init_worker(network, state, settings)
+        rows = [_evaluate(z) for z in edges]
+
+    rows.sort(key=lambda row: -row['increase'])
+    return state, rows
+
+
+def write_ranking(output_file, rows):
+    """写出关键路段排序表（CSV）"""
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    columns = ['edge', 'increase', 'total_travel_time', 'rerouted_demand', 'disconnected_demand', 'iterations',
+               'relative_gap']
+    with open(output_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rank'] + columns)
+        for rank, row in enumerate(rows, 1):
+            writer.writerow([rank] + [row[column] for column in columns])
+
+
+def main():
+    """命令行入口: python vulnerability.py network.json demand.json [output/critical_links.csv]"""
+    network_file = sys.argv[1] if len(sys.argv) > 1 else 'network.json'
+    demand_file = sys.argv[2] if len(sys.argv) > 2 else 'demand.json'
+    output_file = sys.argv[3] if len(sys.argv) > 3 else 'output/critical_links.csv'
+
+    network = Network(network_file, demand_file, cache_dir='.cache')
+    state, rows = rank_critical_links(network)
+    print(f"基础均衡: 路网总出行时间={state['total_travel_time']:.1f} 分钟, 相对间隙={state['relative_gap']:.2e}\n")
+    for rank, row in enumerate(rows[:20], 1):
+        note = f", 断开需求={row['disconnected_demand']:.1f}" if row['disconnected_demand'] > 0 else ""
+        print(f"{rank:3d}. {row['edge']}: 总出行时间增加={row['increase']:.1f} 分钟, "
+              f"改道需求={row['rerouted_demand']:.1f}{note}")
+    write_ranking(output_file, rows)
+    print(f"\n结果已保存到 {output_file}")
+
+
+if __name__ == "__main__":
+    main()